@@ -3,24 +3,35 @@
 import asyncio
 import hashlib
 import inspect
+import json
 import logging
 import math
 import os
-from collections import defaultdict
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from fileinput import filename
 from typing import (
     AsyncGenerator,
+    AsyncIterable,
+    AsyncIterator,
     Awaitable,
     BinaryIO,
+    Callable,
     DefaultDict,
+    Deque,
+    Dict,
+    Iterator,
     List,
     Optional,
+    Set,
     Tuple,
     Union,
 )
 
 from telethon import TelegramClient, helpers, utils
 from telethon.crypto import AuthKey
+from telethon.errors import BadRequestError, FileMigrateError, FloodWaitError
 from telethon.network import MTProtoSender
 from telethon.tl.alltlobjects import LAYER
 from telethon.tl.functions import InvokeWithLayerRequest
@@ -55,55 +66,576 @@ TypeLocation = Union[
 ]
 
 
-class UploadSender:
+# Idle senders are disconnected after this many seconds without a lease.
+SENDER_IDLE_TIMEOUT = 60
+# Idle senders kept per DC; extra ones are disconnected when returned.
+MAX_IDLE_SENDERS = 20
+
+
+class SenderPool:
+    """
+    Connected, authorized MTProto senders per DC that transfers lease and give
+    back, so an upload doesn't pay for the connection and the auth export on
+    every file.
+
+    Foreign DCs are authorized once and the resulting auth key is reused for
+    every further sender to that DC. Returned senders that are disconnected or
+    broke during a transfer are dropped and replaced by a fresh one on the
+    next lease.
+    """
+
+    def __init__(
+        self,
+        client: TelegramClient,
+        idle_timeout: float = SENDER_IDLE_TIMEOUT,
+        max_idle: int = MAX_IDLE_SENDERS,
+    ) -> None:
+        self.client = client
+        self.idle_timeout = idle_timeout
+        self.max_idle = max_idle
+        self.idle: DefaultDict[int, List[Tuple[MTProtoSender, float]]] = defaultdict(
+            list
+        )
+        self.leased: DefaultDict[int, int] = defaultdict(int)
+        self.auth_keys: Dict[int, AuthKey] = {}
+        self._auth_locks: DefaultDict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self._reaper: Optional[asyncio.Task] = None
+
+    async def acquire(self, dc_id: int) -> MTProtoSender:
+        """Leases a connected sender for `dc_id`, reusing an idle one if possible."""
+        idle = self.idle.get(dc_id)
+        while idle:
+            sender, _ = idle.pop()
+            if sender.is_connected():
+                self.leased[dc_id] += 1
+                return sender
+            await self._disconnect(sender)
+        sender = await self._connect(dc_id)
+        self.leased[dc_id] += 1
+        return sender
+
+    async def release(
+        self, dc_id: int, sender: MTProtoSender, broken: bool = False
+    ) -> None:
+        """
+        Returns a leased sender. Pass `broken` if a request on it failed, so
+        it's replaced rather than handed out again.
+        """
+        self.leased[dc_id] -= 1
+        idle = self.idle[dc_id]
+        if broken or not sender.is_connected() or len(idle) >= self.max_idle:
+            await self._disconnect(sender)
+            return
+        idle.append((sender, time.monotonic()))
+        if not self._reaper or self._reaper.done():
+            self._reaper = self.client.loop.create_task(self._reap())
+
+    async def _connect(self, dc_id: int) -> MTProtoSender:
+        if dc_id == self.client.session.dc_id:
+            return await self._new_sender(dc_id, self.client.session.auth_key)
+        if dc_id in self.auth_keys:
+            return await self._new_sender(dc_id, self.auth_keys[dc_id])
+        async with self._auth_locks[dc_id]:
+            if dc_id in self.auth_keys:
+                return await self._new_sender(dc_id, self.auth_keys[dc_id])
+            sender = await self._new_sender(dc_id, None)
+            log.debug(f"Exporting auth to DC {dc_id}")
+            try:
+                auth = await self.client(ExportAuthorizationRequest(dc_id))
+                self.client._init_request.query = ImportAuthorizationRequest(
+                    id=auth.id, bytes=auth.bytes
+                )
+                req = InvokeWithLayerRequest(LAYER, self.client._init_request)
+                await sender.send(req)
+            except BaseException:
+                await self._disconnect(sender)
+                raise
+            self.auth_keys[dc_id] = sender.auth_key
+            return sender
+
+    async def _new_sender(
+        self, dc_id: int, auth_key: Optional[AuthKey]
+    ) -> MTProtoSender:
+        dc = await self.client._get_dc(dc_id)
+        sender = MTProtoSender(auth_key, loggers=self.client._log)
+        await sender.connect(
+            self.client._connection(
+                dc.ip_address,
+                dc.port,
+                dc.id,
+                loggers=self.client._log,
+                proxy=self.client._proxy,
+            )
+        )
+        return sender
+
+    @staticmethod
+    async def _disconnect(sender: MTProtoSender) -> None:
+        try:
+            await sender.disconnect()
+        except Exception as e:
+            log.debug(f"Failed to disconnect sender: {e}")
+
+    async def _reap(self) -> None:
+        """Disconnects senders idle for longer than `idle_timeout`."""
+        while any(self.idle.values()):
+            await asyncio.sleep(self.idle_timeout / 2)
+            deadline = time.monotonic() - self.idle_timeout
+            # release() may add a DC while a disconnect below is awaited.
+            for dc_id, idle in list(self.idle.items()):
+                expired = [sender for sender, since in idle if since < deadline]
+                idle[:] = [(sender, since) for sender, since in idle if since >= deadline]
+                for sender in expired:
+                    log.debug(f"Closing idle sender to DC {dc_id}")
+                    await self._disconnect(sender)
+
+    async def close(self) -> None:
+        """Disconnects every idle sender."""
+        if self._reaper:
+            self._reaper.cancel()
+        for idle in list(self.idle.values()):
+            senders = [sender for sender, _ in idle]
+            idle.clear()
+            for sender in senders:
+                await self._disconnect(sender)
+
+    def stats(self) -> dict:
+        dcs = set(self.idle) | set(self.leased)
+        return {
+            dc_id: {
+                "idle": len(self.idle.get(dc_id, ())),
+                "leased": self.leased.get(dc_id, 0),
+            }
+            for dc_id in sorted(dcs)
+        }
+
+
+_sender_pools: Dict[TelegramClient, SenderPool] = {}
+
+
+def get_sender_pool(client: TelegramClient) -> SenderPool:
+    """Returns the sender pool of `client`, creating it on first use."""
+    if client not in _sender_pools:
+        _sender_pools[client] = SenderPool(client)
+    return _sender_pools[client]
+
+
+# Connections all concurrent uploads share. Every upload gets at least one.
+MAX_UPLOAD_CONNECTIONS = 40
+# Seconds between two re-splits of the budget while uploads are running.
+REBALANCE_INTERVAL = 2.0
+# An upload's claim on the budget grows by its remaining bytes once every
+# this many seconds of its age, so old uploads aren't starved by new ones.
+AGE_WEIGHT = 60
+
+
+# Attempts per part before the upload gives up, and the first backoff
+# between them in seconds, doubled on every retry.
+PART_RETRIES = 5
+RETRY_BACKOFF = 1.0
+# Longer FLOOD_WAITs than this fail the part instead of sleeping through.
+MAX_FLOOD_WAIT = 300
+# File reads and MD5 hashing for uploads run on this many threads, so they
+# stay off the event loop, and each upload reads this many parts ahead.
+READ_WORKERS = 4
+PREFETCH_PARTS = 4
+# Checkpoints of unfinished uploads live next to the file. Telegram drops
+# the parts of an upload that is never finished after a while, so older
+# checkpoints are ignored.
+CHECKPOINT_SUFFIX = ".upload"
+CHECKPOINT_MAX_AGE = 60 * 60
+CHECKPOINT_INTERVAL = 5.0
+# Parts each upload connection keeps in flight at once, so a high-RTT DC can
+# be saturated without opening more sockets.
+UPLOAD_WINDOW = 2
+
+
+class UploadSlot:
+    """An upload's entry in the scheduler and the connections it may use."""
+
+    def __init__(self, file_size: int, limit: int, name: Optional[str] = None):
+        self.file_size = file_size
+        self.limit = max(limit, 1)
+        self.name = name
+        self.sent = 0
+        self.started = time.monotonic()
+        self.share = 1
+
+    def weight(self, now: float) -> float:
+        remaining = max(self.file_size - self.sent, 0)
+        return remaining * (1 + (now - self.started) / AGE_WEIGHT)
+
+
+class UploadScheduler:
+    """
+    Splits a process-wide connection budget across the running uploads, in
+    proportion to their remaining bytes weighted by their age, and never
+    above what an upload asked for. The split is redone when an upload
+    starts or ends and every `REBALANCE_INTERVAL` seconds while they run.
+    Uploads pick up their new share at the next part.
+    """
+
+    def __init__(self, budget: int = MAX_UPLOAD_CONNECTIONS) -> None:
+        self.budget = budget
+        self.slots: List[UploadSlot] = []
+        self._rebalanced = 0.0
+
+    def register(
+        self, file_size: int, limit: int, name: Optional[str] = None
+    ) -> UploadSlot:
+        slot = UploadSlot(file_size, limit, name)
+        self.slots.append(slot)
+        self._rebalance()
+        return slot
+
+    def unregister(self, slot: UploadSlot) -> None:
+        if slot in self.slots:
+            self.slots.remove(slot)
+            self._rebalance()
+
+    def set_limit(self, slot: UploadSlot, limit: int) -> None:
+        """Changes how many connections an upload asks for."""
+        limit = max(limit, 1)
+        if limit != slot.limit:
+            slot.limit = limit
+            self._rebalance()
+
+    def progress(self, slot: UploadSlot, sent: int) -> None:
+        slot.sent = sent
+        if time.monotonic() - self._rebalanced >= REBALANCE_INTERVAL:
+            self._rebalance()
+
+    def _rebalance(self) -> None:
+        now = time.monotonic()
+        self._rebalanced = now
+        weights = {id(slot): slot.weight(now) for slot in self.slots}
+        for slot in self.slots:
+            slot.share = 1
+        left = self.budget - len(self.slots)
+        # Hand out the rest one connection at a time to the upload with the
+        # highest weight per connection it already has.
+        while left > 0:
+            candidates = [slot for slot in self.slots if slot.share < slot.limit]
+            if not candidates:
+                break
+            best = max(candidates, key=lambda slot: weights[id(slot)] / slot.share)
+            best.share += 1
+            left -= 1
+
+    def allocation(self) -> List[dict]:
+        """The current share of every running upload, for reporting."""
+        now = time.monotonic()
+        return [
+            {
+                "name": slot.name,
+                "connections": slot.share,
+                "limit": slot.limit,
+                "sent": slot.sent,
+                "size": slot.file_size,
+                "age": round(now - slot.started, 1),
+            }
+            for slot in self.slots
+        ]
+
+
+scheduler = UploadScheduler()
+
+
+# Connections a new upload to a DC starts with before anything is known.
+INITIAL_CONNECTIONS = 4
+# Seconds of upload between two throughput samples, the connections added
+# while they keep helping, and the gain in throughput that counts as help.
+TUNE_INTERVAL = 2.0
+RAMP_STEP = 2
+RAMP_GAIN = 0.05
+
+
+class ConnectionTuner:
+    """
+    Hill-climbs the number of connections of one upload on its measured
+    throughput: it starts at the best count seen on the DC so far, adds
+    `RAMP_STEP` connections while each step raises the bytes/s by more than
+    `RAMP_GAIN`, goes back to the best count seen when throughput drops, and
+    halves on FLOOD_WAITs and timeouts without climbing back to where they
+    happened. The best count is remembered per DC
+    for the next upload.
+    """
+
+    best_counts: Dict[int, int] = {}
+
+    def __init__(self, dc_id: int, cap: int) -> None:
+        self.dc_id = dc_id
+        self.cap = max(cap, 1)
+        self.count = min(self.best_counts.get(dc_id, INITIAL_CONNECTIONS), self.cap)
+        # Never climb back to a count that got us flood waits.
+        self.ceiling = self.cap
+        self.rates: Dict[int, float] = {}
+        self.last_rate = 0.0
+        self.last_sent = 0
+        self.last_at = time.monotonic()
+        self.backed_off = 0.0
+
+    def sample(self, sent: int, connections: int) -> int:
+        """
+        Takes a throughput sample every `TUNE_INTERVAL` seconds and returns
+        the connection count the upload should ask for.
+        """
+        now = time.monotonic()
+        if now - self.last_at < TUNE_INTERVAL:
+            return self.count
+        rate = (sent - self.last_sent) / (now - self.last_at)
+        self.last_sent, self.last_at = sent, now
+        self.rates[connections] = rate
+        # Only climb when we actually got what we asked for; with fewer
+        # connections the scheduler is the limit, not the DC.
+        if connections == self.count:
+            if rate > self.last_rate * (1 + RAMP_GAIN):
+                self.count = min(self.count + RAMP_STEP, self.ceiling)
+            elif rate < self.last_rate * (1 - RAMP_GAIN):
+                self.count = min(self.best(), self.ceiling)
+        self.last_rate = rate
+        return self.count
+
+    def back_off(self) -> int:
+        """Halves the count after a FLOOD_WAIT or timeout, once per interval."""
+        now = time.monotonic()
+        if now - self.backed_off >= TUNE_INTERVAL:
+            self.backed_off = now
+            self.ceiling = max(min(self.ceiling, self.count - 1), 1)
+            self.count = max(self.count // 2, 1)
+            self.best_counts[self.dc_id] = min(
+                self.best_counts.get(self.dc_id, self.count), self.count
+            )
+            # Rates measured with more connections than that can't be trusted.
+            self.rates = {c: r for c, r in self.rates.items() if c <= self.count}
+            self.last_rate = 0.0
+        return self.count
+
+    def best(self) -> int:
+        if not self.rates:
+            return self.count
+        return max(self.rates, key=self.rates.get)
+
+    def finish(self) -> None:
+        if self.rates:
+            self.best_counts[self.dc_id] = self.best()
+
+
+class UploadCheckpoint:
+    """
+    The parts of a file upload Telegram has acknowledged, kept as
+    `<filename>.upload`, so that a retried upload of the same file reuses its
+    file_id and only sends the parts that are missing.
+    """
+
+    def __init__(self, filename: str, file_size: int, part_size: int) -> None:
+        self.path = f"{filename}{CHECKPOINT_SUFFIX}"
+        self.file_size = file_size
+        self.part_size = part_size
+        self.file_id = helpers.generate_random_long()
+        self.created = time.time()
+        self.acked: Set[int] = set()
+        self._saved = time.monotonic()
+
+    def load(self) -> bool:
+        """Picks up a matching checkpoint. Returns whether there was one."""
+        try:
+            with open(self.path) as file:
+                data = json.load(file)
+            if (
+                data["file_size"] != self.file_size
+                or data["part_size"] != self.part_size
+                or time.time() - data["created"] > CHECKPOINT_MAX_AGE
+            ):
+                return False
+            file_id, acked = int(data["file_id"]), set(map(int, data["acked"]))
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        self.file_id, self.acked, self.created = file_id, acked, data["created"]
+        return True
+
+    def ack(self, part: int) -> None:
+        self.acked.add(part)
+        if time.monotonic() - self._saved >= CHECKPOINT_INTERVAL:
+            self.save()
+
+    def save(self) -> None:
+        self._saved = time.monotonic()
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w") as file:
+                json.dump(
+                    {
+                        "file_id": self.file_id,
+                        "file_size": self.file_size,
+                        "part_size": self.part_size,
+                        "created": self.created,
+                        "acked": sorted(self.acked),
+                    },
+                    file,
+                )
+            os.replace(tmp, self.path)
+        except OSError as e:
+            log.warning(f"Failed to save upload checkpoint {self.path}: {e}")
+
+    def remove(self) -> None:
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class _RetryingSender:
+    """
+    A leased connection that retries requests with backoff. FLOOD_WAITs are
+    slept through, and a connection that failed is swapped for a fresh one
+    from the pool before the request is sent again. Bad requests aren't
+    retried.
+    """
+
     client: TelegramClient
+    pool: SenderPool
+    dc_id: int
     sender: MTProtoSender
-    request: Union[SaveFilePartRequest, SaveBigFilePartRequest]
+    on_congestion: Optional[Callable[[], None]]
+
+    def __init__(
+        self,
+        client: TelegramClient,
+        pool: SenderPool,
+        dc_id: int,
+        sender: MTProtoSender,
+        on_congestion: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.client = client
+        self.pool = pool
+        self.dc_id = dc_id
+        self.sender = sender
+        self.on_congestion = on_congestion
+        self._replacing = asyncio.Lock()
+
+    async def _invoke(self, request, what: str):
+        for attempt in range(PART_RETRIES):
+            sender = self.sender
+            try:
+                return await self.client._call(
+                    sender, request, flood_sleep_threshold=0
+                )
+            except FloodWaitError as e:
+                if self.on_congestion:
+                    self.on_congestion()
+                if e.seconds > MAX_FLOOD_WAIT or attempt == PART_RETRIES - 1:
+                    raise
+                log.warning(f"Flood wait of {e.seconds}s on {what}")
+                await asyncio.sleep(e.seconds)
+            except (BadRequestError, FileMigrateError):
+                raise
+            except Exception as e:
+                if self.on_congestion and isinstance(e, asyncio.TimeoutError):
+                    self.on_congestion()
+                if attempt == PART_RETRIES - 1:
+                    raise
+                log.warning(f"{what.capitalize()} failed, retrying: {e!r}")
+                await asyncio.sleep(RETRY_BACKOFF * 2**attempt)
+                try:
+                    await self._replace(sender)
+                except Exception as e:
+                    log.warning(f"Failed to replace sender to DC {self.dc_id}: {e}")
+
+    async def _replace(self, sender: MTProtoSender, dc_id: Optional[int] = None) -> None:
+        """
+        Swaps `sender` for a new connection (to `dc_id`, if given), unless
+        another request already did.
+        """
+        async with self._replacing:
+            if sender is not self.sender:
+                return
+            old_dc_id, dc_id = self.dc_id, dc_id or self.dc_id
+            self.sender = await self.pool.acquire(dc_id)
+            self.dc_id = dc_id
+            await self.pool.release(old_dc_id, sender, broken=True)
+
+
+class UploadSender(_RetryingSender):
+    file_id: int
     part_count: int
-    stride: int
-    previous: Optional[asyncio.Task]
+    big: bool
+    window: int
+    pending: Set[asyncio.Task]
+    on_ack: Optional[Callable[[int], None]]
     loop: asyncio.AbstractEventLoop
 
     def __init__(
         self,
         client: TelegramClient,
+        pool: SenderPool,
+        dc_id: int,
         sender: MTProtoSender,
         file_id: int,
         part_count: int,
         big: bool,
-        index: int,
-        stride: int,
         loop: asyncio.AbstractEventLoop,
+        window: int = UPLOAD_WINDOW,
+        on_ack: Optional[Callable[[int], None]] = None,
+        on_congestion: Optional[Callable[[], None]] = None,
     ) -> None:
-        self.client = client
-        self.sender = sender
+        super().__init__(client, pool, dc_id, sender, on_congestion)
+        self.file_id = file_id
         self.part_count = part_count
-        if big:
-            self.request = SaveBigFilePartRequest(file_id, index, part_count, b"")
-        else:
-            self.request = SaveFilePartRequest(file_id, index, b"")
-        self.stride = stride
-        self.previous = None
+        self.big = big
+        self.window = max(window, 1)
+        self.pending = set()
+        self.on_ack = on_ack
         self.loop = loop
 
-    async def next(self, data: bytes) -> None:
-        if self.previous:
-            await self.previous
-        self.previous = self.loop.create_task(self._next(data))
+    def _request(
+        self, data: bytes, part: int
+    ) -> Union[SaveFilePartRequest, SaveBigFilePartRequest]:
+        if self.big:
+            return SaveBigFilePartRequest(self.file_id, part, self.part_count, data)
+        return SaveFilePartRequest(self.file_id, part, data)
+
+    async def _drain(self, limit: int) -> None:
+        """Waits until at most `limit` parts are in flight."""
+        while len(self.pending) > limit:
+            done, self.pending = await asyncio.wait(
+                self.pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            errors = [
+                task.exception()
+                for task in done
+                if not task.cancelled() and task.exception()
+            ]
+            if errors:
+                raise errors[0]
 
-    async def _next(self, data: bytes) -> None:
-        self.request.bytes = data
+    async def next(self, data: bytes, part: int) -> None:
+        """
+        Queues `part` on this connection, waiting first if `window` parts are
+        already in flight. Parts may complete out of order.
+        """
+        await self._drain(self.window - 1)
+        self.pending.add(self.loop.create_task(self._next(data, part)))
+
+    async def _next(self, data: bytes, part: int) -> None:
         log.debug(
-            f"Sending file part {self.request.file_part}/{self.part_count}"
-            f" with {len(data)} bytes"
+            f"Sending file part {part}/{self.part_count} with {len(data)} bytes"
         )
-        await self.client._call(self.sender, self.request)
-        self.request.file_part += self.stride
+        await self._invoke(self._request(data, part), f"file part {part}")
+        if self.on_ack:
+            self.on_ack(part)
 
     async def disconnect(self) -> None:
-        if self.previous:
-            await self.previous
-        return await self.sender.disconnect()
+        """Waits for the parts in flight and returns the sender to the pool."""
+        try:
+            await self._drain(0)
+        except BaseException:
+            for task in self.pending:
+                task.cancel()
+            self.pending.clear()
+            await self.pool.release(self.dc_id, self.sender, broken=True)
+            raise
+        await self.pool.release(self.dc_id, self.sender)
 
 
 class ParallelTransferrer:
@@ -111,24 +643,47 @@ class ParallelTransferrer:
     loop: asyncio.AbstractEventLoop
     dc_id: int
     senders: Optional[List[Union[UploadSender]]]
-    auth_key: AuthKey
+    pool: SenderPool
+    slot: Optional[UploadSlot]
+    checkpoint: Optional[UploadCheckpoint]
+    tuner: Optional[ConnectionTuner]
     upload_ticker: int
+    window: int
 
-    def __init__(self, client: TelegramClient, dc_id: Optional[int] = None) -> None:
+    def __init__(
+        self,
+        client: TelegramClient,
+        dc_id: Optional[int] = None,
+        window: int = UPLOAD_WINDOW,
+    ) -> None:
         self.client = client
+        self.window = window
         self.loop = self.client.loop
         self.dc_id = dc_id or self.client.session.dc_id
-        self.auth_key = (
-            None
-            if dc_id and self.client.session.dc_id != dc_id
-            else self.client.session.auth_key
-        )
+        self.pool = get_sender_pool(client)
         self.senders = None
+        self.slot = None
+        self.checkpoint = None
+        self.tuner = None
         self.upload_ticker = 0
+        self.part_index = 0
+        self.sent = 0
 
     async def _cleanup(self) -> None:
-        await asyncio.gather(*[sender.disconnect() for sender in self.senders])
-        self.senders = None
+        if self.tuner:
+            self.tuner.finish()
+            self.tuner = None
+        if self.slot:
+            scheduler.unregister(self.slot)
+            self.slot = None
+        if self.senders:
+            senders, self.senders = self.senders, None
+            results = await asyncio.gather(
+                *[sender.disconnect() for sender in senders], return_exceptions=True
+            )
+            for r in results:
+                if isinstance(r, BaseException):
+                    raise r
 
     @staticmethod
     def _get_connection_count(
@@ -141,52 +696,47 @@ class ParallelTransferrer:
     async def _init_upload(
         self, connections: int, file_id: int, part_count: int, big: bool
     ) -> None:
-        self.senders = [
-            await self._create_upload_sender(file_id, part_count, big, 0, connections),
-            *await asyncio.gather(
-                *[
-                    self._create_upload_sender(file_id, part_count, big, i, connections)
-                    for i in range(1, connections)
-                ]
-            ),
-        ]
+        self.file_id, self.part_count, self.big = file_id, part_count, big
+        results = await asyncio.gather(
+            *[self._create_upload_sender() for _ in range(connections)],
+            return_exceptions=True,
+        )
+        senders = [r for r in results if isinstance(r, UploadSender)]
+        for r in results:
+            if isinstance(r, BaseException):
+                await asyncio.gather(*[sender.disconnect() for sender in senders])
+                raise r
+        self.senders = senders
 
-    async def _create_upload_sender(
-        self, file_id: int, part_count: int, big: bool, index: int, stride: int
-    ) -> UploadSender:
+    async def _create_upload_sender(self) -> UploadSender:
         return UploadSender(
             self.client,
+            self.pool,
+            self.dc_id,
             await self._create_sender(),
-            file_id,
-            part_count,
-            big,
-            index,
-            stride,
+            self.file_id,
+            self.part_count,
+            self.big,
             loop=self.loop,
+            window=self.window,
+            on_ack=self.checkpoint.ack if self.checkpoint else None,
+            on_congestion=self._on_congestion,
         )
 
+    def _on_congestion(self) -> None:
+        if self.tuner and self.slot:
+            scheduler.set_limit(self.slot, self.tuner.back_off())
+
+    async def _resize(self) -> None:
+        """Grows or shrinks the senders to the share the scheduler gave us."""
+        while len(self.senders) < self.slot.share:
+            self.senders.append(await self._create_upload_sender())
+        while len(self.senders) > self.slot.share:
+            await self.senders.pop().disconnect()
+        self.upload_ticker %= len(self.senders)
+
     async def _create_sender(self) -> MTProtoSender:
-        dc = await self.client._get_dc(self.dc_id)
-        sender = MTProtoSender(self.auth_key, loggers=self.client._log)
-        await sender.connect(
-            self.client._connection(
-                dc.ip_address,
-                dc.port,
-                dc.id,
-                loggers=self.client._log,
-                proxy=self.client._proxy,
-            )
-        )
-        if not self.auth_key:
-            log.debug(f"Exporting auth to DC {self.dc_id}")
-            auth = await self.client(ExportAuthorizationRequest(self.dc_id))
-            self.client._init_request.query = ImportAuthorizationRequest(
-                id=auth.id, bytes=auth.bytes
-            )
-            req = InvokeWithLayerRequest(LAYER, self.client._init_request)
-            await sender.send(req)
-            self.auth_key = sender.auth_key
-        return sender
+        return await self.pool.acquire(self.dc_id)
 
     async def init_upload(
         self,
@@ -194,33 +744,275 @@ class ParallelTransferrer:
         file_size: int,
         part_size_kb: Optional[float] = None,
         connection_count: Optional[int] = None,
+        file_name: Optional[str] = None,
+        checkpoint: Optional[UploadCheckpoint] = None,
     ) -> Tuple[int, int, bool]:
-        connection_count = connection_count or self._get_connection_count(file_size)
+        """
+        Opens the senders for an upload. Without a fixed `connection_count`
+        the count is tuned while the upload runs, up to what the file size
+        calls for. With a `checkpoint`, parts it lists as acknowledged are
+        skipped by `upload` and new acks are recorded in it.
+        """
+        self.checkpoint = checkpoint
+        if not connection_count:
+            cap = self._get_connection_count(file_size)
+            self.tuner = ConnectionTuner(self.dc_id, cap)
+            connection_count = self.tuner.count
         part_size = (part_size_kb or utils.get_appropriated_part_size(file_size)) * 1024
         part_count = (file_size + part_size - 1) // part_size
         is_large = file_size > 10 * 1024 * 1024
-        await self._init_upload(connection_count, file_id, part_count, is_large)
+        self.slot = scheduler.register(file_size, connection_count, file_name)
+        try:
+            await self._init_upload(self.slot.share, file_id, part_count, is_large)
+        except BaseException:
+            await self._cleanup()
+            raise
         return part_size, part_count, is_large
 
     async def upload(self, part: bytes) -> None:
-        await self.senders[self.upload_ticker].next(part)
+        index = self.part_index
+        self.part_index += 1
+        self.sent += len(part)
+        if self.checkpoint and index in self.checkpoint.acked:
+            return
+        if self.tuner:
+            scheduler.set_limit(
+                self.slot, self.tuner.sample(self.sent, len(self.senders))
+            )
+        scheduler.progress(self.slot, self.sent)
+        if len(self.senders) != self.slot.share:
+            await self._resize()
+        await self.senders[self.upload_ticker].next(part, index)
         self.upload_ticker = (self.upload_ticker + 1) % len(self.senders)
 
     async def finish_upload(self) -> None:
-        await self._cleanup()
+        try:
+            await self._cleanup()
+        finally:
+            if self.checkpoint:
+                if len(self.checkpoint.acked) >= self.part_count:
+                    self.checkpoint.remove()
+                else:
+                    self.checkpoint.save()
 
 
-parallel_transfer_locks: DefaultDict[int, asyncio.Lock] = defaultdict(
-    lambda: asyncio.Lock()
-)
+# Bytes per GetFile request. Offsets have to be multiples of it, and 1 MiB a
+# multiple of it.
+DOWNLOAD_PART_SIZE = 512 * 1024
+
+
+class DownloadSender(_RetryingSender):
+    """
+    Fetches every `stride`-th part of a file, starting at part `index`, over
+    one leased connection, keeping up to `window` requests in flight.
+    """
+
+    def __init__(
+        self,
+        downloader: "ParallelDownloader",
+        sender: MTProtoSender,
+        location,
+        index: int,
+        stride: int,
+        part_count: int,
+        part_size: int,
+        window: int = UPLOAD_WINDOW,
+    ) -> None:
+        super().__init__(
+            downloader.client, downloader.pool, downloader.dc_id, sender
+        )
+        self.downloader = downloader
+        self.location = location
+        self.parts = iter(range(index, part_count, stride))
+        self.part_size = part_size
+        self.window = max(window, 1)
+        self.pending: Deque[asyncio.Task] = deque()
+        self.failed = False
+
+    def _fill(self) -> None:
+        while len(self.pending) < self.window:
+            part = next(self.parts, None)
+            if part is None:
+                return
+            self.pending.append(
+                self.downloader.loop.create_task(self._fetch(part * self.part_size))
+            )
+
+    async def next(self) -> Optional[bytes]:
+        """Returns the next of this connection's parts, in order."""
+        self._fill()
+        if not self.pending:
+            return None
+        try:
+            data = await self.pending.popleft()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # The task is gone from `pending` by the time disconnect() looks.
+            self.failed = True
+            raise
+        self._fill()
+        return data
+
+    async def _fetch(self, offset: int) -> bytes:
+        request = GetFileRequest(self.location, offset, self.part_size)
+        while True:
+            try:
+                result = await self._invoke(request, f"file offset {offset}")
+                break
+            except FileMigrateError as e:
+                log.debug(f"File lives in DC {e.new_dc}")
+                await self._replace(self.sender, e.new_dc)
+        return result.bytes
+
+    async def disconnect(self) -> None:
+        for task in self.pending:
+            task.cancel()
+        broken = self.failed or any(
+            task.done() and not task.cancelled() and task.exception()
+            for task in self.pending
+        )
+        self.pending.clear()
+        await self.pool.release(self.dc_id, self.sender, broken=broken)
 
 
-def stream_file(file_to_stream: BinaryIO, chunk_size=1024):
+class ParallelDownloader:
+    """
+    Downloads a file from Telegram over several leased connections, each
+    fetching every n-th part, and hands the parts back in order.
+
+    The connection count is taken from the upload scheduler's budget when the
+    download starts and kept until it ends. GetFile is sent without
+    `cdn_supported`, so every part comes from the file's own DC; Telethon
+    can't authorize on CDN DCs.
+    """
+
+    client: TelegramClient
+    loop: asyncio.AbstractEventLoop
+    dc_id: int
+    pool: SenderPool
+
+    def __init__(
+        self,
+        client: TelegramClient,
+        dc_id: Optional[int] = None,
+        window: int = UPLOAD_WINDOW,
+    ) -> None:
+        self.client = client
+        self.loop = self.client.loop
+        self.dc_id = dc_id or self.client.session.dc_id
+        self.pool = get_sender_pool(client)
+        self.window = window
+
+    async def download(
+        self,
+        location,
+        file_size: int,
+        part_size: int = DOWNLOAD_PART_SIZE,
+        connection_count: Optional[int] = None,
+        file_name: Optional[str] = None,
+    ) -> AsyncGenerator[bytes, None]:
+        part_count = max((file_size + part_size - 1) // part_size, 1)
+        limit = connection_count or ParallelTransferrer._get_connection_count(
+            file_size
+        )
+        slot = scheduler.register(file_size, limit, file_name)
+        senders: List[DownloadSender] = []
+        try:
+            connections = min(slot.share, part_count)
+            results = await asyncio.gather(
+                *[self.pool.acquire(self.dc_id) for _ in range(connections)],
+                return_exceptions=True,
+            )
+            for r in results:
+                if isinstance(r, MTProtoSender):
+                    senders.append(
+                        DownloadSender(
+                            self,
+                            r,
+                            location,
+                            len(senders),
+                            connections,
+                            part_count,
+                            part_size,
+                            self.window,
+                        )
+                    )
+            for r in results:
+                if isinstance(r, BaseException):
+                    raise r
+            sent = 0
+            for part in range(part_count):
+                data = await senders[part % connections].next()
+                if not data:
+                    break
+                sent += len(data)
+                scheduler.progress(slot, sent)
+                yield data
+        finally:
+            scheduler.unregister(slot)
+            await asyncio.gather(*[sender.disconnect() for sender in senders])
+
+
+def read_parts(file: BinaryIO, part_size: int) -> Iterator[bytes]:
+    """
+    Yields `file` in parts of exactly `part_size` bytes, the last one may be
+    shorter. Each part is read straight from the file into its own bytes
+    object: Telethon only serializes real bytes, so a view into a reused
+    buffer or an mmap would be copied again anyway.
+    """
     while True:
-        data_read = file_to_stream.read(chunk_size)
-        if not data_read:
+        part = file.read(part_size)
+        if not part:
             break
-        yield data_read
+        yield part
+
+
+_io_executor = ThreadPoolExecutor(READ_WORKERS, thread_name_prefix="upload-io")
+
+
+def _read_part(file: BinaryIO, part_size: int, hasher) -> bytes:
+    part = file.read(part_size)
+    if hasher is not None and part:
+        hasher.update(part)
+    return part
+
+
+async def prefetch_parts(
+    file: BinaryIO, part_size: int, hasher=None, depth: int = PREFETCH_PARTS
+) -> AsyncIterator[bytes]:
+    """
+    Like `read_parts`, but every read (and the `hasher` update, if given)
+    runs on the upload I/O threads. A reader task stays up to `depth` parts
+    ahead, so the next parts are read while the current one is being sent.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=depth)
+
+    async def produce() -> None:
+        try:
+            while True:
+                part = await loop.run_in_executor(
+                    _io_executor, _read_part, file, part_size, hasher
+                )
+                if not part:
+                    break
+                await queue.put(part)
+            await queue.put(None)
+        except Exception as e:
+            await queue.put(e)
+
+    producer = loop.create_task(produce())
+    try:
+        while True:
+            part = await queue.get()
+            if part is None:
+                return
+            if isinstance(part, Exception):
+                raise part
+            yield part
+    finally:
+        producer.cancel()
 
 
 async def _internal_transfer_to_telegram(
@@ -228,36 +1020,36 @@ async def _internal_transfer_to_telegram(
     response: BinaryIO,
     progress_callback: callable,
     file_name: str = None,
+    checkpoint: bool = False,
 ) -> Tuple[TypeInputFile, int]:
-    file_id = helpers.generate_random_long()
     file_size = os.path.getsize(response.name)
+    saved = None
+    if checkpoint:
+        saved = UploadCheckpoint(response.name, file_size, get_part_size(file_size))
+        if saved.load():
+            log.info(
+                f"Resuming upload of {response.name}"
+                f" with {len(saved.acked)} parts already sent"
+            )
+    file_id = saved.file_id if saved else helpers.generate_random_long()
 
     hash_md5 = hashlib.md5()
     uploader = ParallelTransferrer(client)
-    part_size, part_count, is_large = await uploader.init_upload(file_id, file_size)
-    buffer = bytearray()
-    for data in stream_file(response):
-        if progress_callback:
-            r = progress_callback(response.tell(), file_size)
-            if inspect.isawaitable(r):
-                await r
-        if not is_large:
-            hash_md5.update(data)
-        if len(buffer) == 0 and len(data) == part_size:
-            await uploader.upload(data)
-            continue
-        new_len = len(buffer) + len(data)
-        if new_len >= part_size:
-            cutoff = part_size - len(buffer)
-            buffer.extend(data[:cutoff])
-            await uploader.upload(bytes(buffer))
-            buffer.clear()
-            buffer.extend(data[cutoff:])
-        else:
-            buffer.extend(data)
-    if len(buffer) > 0:
-        await uploader.upload(bytes(buffer))
-    await uploader.finish_upload()
+    part_size, part_count, is_large = await uploader.init_upload(
+        file_id, file_size, file_name=file_name, checkpoint=saved
+    )
+    try:
+        position = 0
+        hasher = None if is_large else hash_md5
+        async for part in prefetch_parts(response, part_size, hasher):
+            await uploader.upload(part)
+            position += len(part)
+            if progress_callback:
+                r = progress_callback(position, file_size)
+                if inspect.isawaitable(r):
+                    await r
+    finally:
+        await uploader.finish_upload()
     if is_large:
         return (
             InputFileBig(file_id, part_count, file_name if file_name else "upload"),
@@ -280,8 +1072,287 @@ async def upload_file(
     file: BinaryIO,
     progress_callback: callable = None,
     file_name: str = None,
+    checkpoint: bool = False,
 ) -> TypeInputFile:
     res = (
-        await _internal_transfer_to_telegram(client, file, progress_callback, file_name)
+        await _internal_transfer_to_telegram(
+            client, file, progress_callback, file_name, checkpoint
+        )
     )[0]
     return res
+
+
+async def upload_part(
+    client: TelegramClient,
+    file: Union[BinaryIO, memoryview],
+    input_file: TypeInputFile,
+    part: int,
+) -> None:
+    """
+    Sends a single part of an uploaded file again, for when Telegram reports
+    it missing (FILE_PART_X_MISSING) while the file is being sent. `file` is
+    the file on disk or the buffer it was uploaded from.
+    """
+    if isinstance(file, memoryview):
+        part_size = get_part_size(len(file))
+        data = bytes(file[part * part_size : (part + 1) * part_size])
+    else:
+        part_size = get_part_size(os.path.getsize(file.name))
+        file.seek(part * part_size)
+        data = await asyncio.get_running_loop().run_in_executor(
+            _io_executor, file.read, part_size
+        )
+    if isinstance(input_file, InputFileBig):
+        request = SaveBigFilePartRequest(input_file.id, part, input_file.parts, data)
+    else:
+        request = SaveFilePartRequest(input_file.id, part, data)
+    await client(request)
+
+
+def get_part_size(file_size: int) -> int:
+    """The size in bytes of every part but the last one for a file of `file_size`."""
+    return utils.get_appropriated_part_size(file_size) * 1024
+
+
+async def upload_stream(
+    client: TelegramClient,
+    parts: AsyncIterable[bytes],
+    file_size: int,
+    progress_callback: callable = None,
+    file_name: str = None,
+) -> TypeInputFile:
+    """
+    Uploads a file whose size is known up front from an async iterable of
+    parts, e.g. straight from an HTTP response, without touching the disk.
+
+    Every part except the last must be exactly `get_part_size(file_size)`
+    bytes long.
+    """
+    file_id = helpers.generate_random_long()
+    hash_md5 = hashlib.md5()
+    uploader = ParallelTransferrer(client)
+    part_size, part_count, is_large = await uploader.init_upload(
+        file_id, file_size, file_name=file_name
+    )
+    uploaded = 0
+    try:
+        async for part in parts:
+            uploaded += len(part)
+            if uploaded > file_size or (
+                len(part) != part_size and uploaded != file_size
+            ):
+                raise ValueError(
+                    f"Unexpected part of {len(part)} bytes at {uploaded - len(part)}"
+                    f" for a file of {file_size} bytes"
+                )
+            if not is_large:
+                await asyncio.get_running_loop().run_in_executor(
+                    _io_executor, hash_md5.update, part
+                )
+            await uploader.upload(part)
+            if progress_callback:
+                r = progress_callback(uploaded, file_size)
+                if inspect.isawaitable(r):
+                    await r
+    finally:
+        await uploader.finish_upload()
+    if uploaded != file_size:
+        raise ValueError(f"Stream ended at {uploaded} of {file_size} bytes")
+    if is_large:
+        return InputFileBig(file_id, part_count, file_name if file_name else "upload")
+    return InputFile(
+        file_id, part_count, file_name if file_name else "upload", hash_md5.hexdigest()
+    )
+
+
+async def _buffer_parts(buffer: memoryview, part_size: int) -> AsyncIterator[bytes]:
+    for offset in range(0, len(buffer), part_size):
+        # Telethon needs bytes, so this is the one copy each part gets.
+        yield bytes(buffer[offset : offset + part_size])
+
+
+async def upload_buffer(
+    client: TelegramClient,
+    buffer: memoryview,
+    progress_callback: callable = None,
+    file_name: str = None,
+) -> TypeInputFile:
+    """Uploads a file that is held in memory, e.g. a small download."""
+    return await upload_stream(
+        client,
+        _buffer_parts(buffer, get_part_size(len(buffer))),
+        len(buffer),
+        progress_callback,
+        file_name,
+    )
+
+
+async def iter_file(
+    client: TelegramClient,
+    location: TypeLocation,
+    file_size: Optional[int] = None,
+    connection_count: Optional[int] = None,
+) -> AsyncGenerator[bytes, None]:
+    """
+    Yields a file stored on Telegram, e.g. a document from the cache channel,
+    in order, while fetching its parts over several connections.
+
+    `file_size` can be left out for documents, which carry their size.
+    """
+    file_size = file_size or getattr(location, "size", None)
+    if not file_size:
+        raise ValueError("The size of the file is required")
+    dc_id, input_location = utils.get_input_location(location)
+    parts = ParallelDownloader(client, dc_id).download(
+        input_location, file_size, connection_count=connection_count
+    )
+    try:
+        async for part in parts:
+            yield part
+    finally:
+        await parts.aclose()
+
+
+async def download_file(
+    client: TelegramClient,
+    location: TypeLocation,
+    out: Union[BinaryIO, str],
+    progress_callback: callable = None,
+    file_size: Optional[int] = None,
+) -> int:
+    """
+    Downloads a file stored on Telegram into `out`, a path or a binary file
+    object. Writes run on the upload I/O threads.
+
+    Returns:
+        int: The number of bytes written.
+    """
+    file_size = file_size or getattr(location, "size", None)
+    loop = asyncio.get_running_loop()
+    file = open(out, "wb") if isinstance(out, str) else out
+    written = 0
+    parts = iter_file(client, location, file_size)
+    try:
+        async for part in parts:
+            await loop.run_in_executor(_io_executor, file.write, part)
+            written += len(part)
+            if progress_callback:
+                r = progress_callback(written, file_size)
+                if inspect.isawaitable(r):
+                    await r
+    finally:
+        await parts.aclose()
+        if isinstance(out, str):
+            file.close()
+    return written
+
+
+if __name__ == "__main__":
+    import tempfile
+    import tracemalloc
+
+    size = 256 * 1024 * 1024
+    part_size = get_part_size(size)
+
+    def legacy(file: BinaryIO, callback: callable) -> int:
+        parts = 0
+        buffer = bytearray()
+        while True:
+            data = file.read(1024)
+            if not data:
+                break
+            callback(file.tell(), size)
+            if len(buffer) == 0 and len(data) == part_size:
+                parts += 1
+                continue
+            if len(buffer) + len(data) >= part_size:
+                cutoff = part_size - len(buffer)
+                buffer.extend(data[:cutoff])
+                bytes(buffer)
+                parts += 1
+                buffer.clear()
+                buffer.extend(data[cutoff:])
+            else:
+                buffer.extend(data)
+        if buffer:
+            bytes(buffer)
+            parts += 1
+        return parts
+
+    def current(file: BinaryIO, callback: callable) -> int:
+        parts = 0
+        position = 0
+        for part in read_parts(file, part_size):
+            position += len(part)
+            callback(position, size)
+            parts += 1
+        return parts
+
+    with tempfile.NamedTemporaryFile() as tmp:
+        tmp.write(os.urandom(size))
+        tmp.flush()
+        for name, run in (("legacy 1 KiB", legacy), ("read_parts", current)):
+            calls = 0
+
+            def callback(current: int, total: int) -> None:
+                global calls
+                calls += 1
+
+            with open(tmp.name, "rb") as file:
+                start = time.process_time()
+                parts = run(file, callback)
+                cpu = time.process_time() - start
+            with open(tmp.name, "rb") as file:
+                tracemalloc.start()
+                run(file, callback)
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            print(
+                f"{name:<14} {cpu / size * 1024**3:6.2f} s CPU/GiB  {parts} parts"
+                f"  {calls // 2:>7} callbacks  {peak / 1024:8.0f} KiB peak"
+            )
+
+        # Loop lag while small files (hashed for InputFile) are read and
+        # hashed inline versus on the upload I/O threads.
+        from looplag import LoopLagMonitor
+
+        async def inline(file: BinaryIO) -> None:
+            hasher = hashlib.md5()
+            for part in read_parts(file, 512 * 1024):
+                hasher.update(part)
+                await asyncio.sleep(0)
+
+        async def offloaded(file: BinaryIO) -> None:
+            async for part in prefetch_parts(file, 512 * 1024, hashlib.md5()):
+                await asyncio.sleep(0)
+
+        async def lag(run) -> list[float]:
+            lag_monitor = LoopLagMonitor(interval=0.005, window=1_000_000)
+            task = asyncio.create_task(lag_monitor.run())
+            await asyncio.sleep(0.02)
+            with open(tmp.name, "rb") as file:
+                await run(file)
+            task.cancel()
+            return list(lag_monitor.samples)
+
+        # A single pass is too short for a stable p99, so every variant hashes
+        # the same file `lag_runs` times and the samples are pooled. The
+        # spread of the per-pass p99 shows how noisy the machine is.
+        lag_runs = 30
+        for name, run in (("inline md5", inline), ("offloaded md5", offloaded)):
+            pooled = LoopLagMonitor(window=1_000_000)
+            p99s = []
+            for _ in range(lag_runs):
+                samples = asyncio.run(lag(run))
+                pooled.samples.extend(samples)
+                pooled.max = max(pooled.max, *samples)
+                single = LoopLagMonitor(window=len(samples))
+                single.samples.extend(samples)
+                p99s.append(single.percentile(0.99) * 1000)
+            stats = pooled.stats()
+            print(
+                f"{name:<14} loop lag p50 {stats['p50_ms']} ms"
+                f"  p99 {stats['p99_ms']} ms  max {stats['max_ms']} ms"
+                f"  ({stats['samples']} samples, per-pass p99"
+                f" {min(p99s):.1f}-{max(p99s):.1f} ms)"
+            )
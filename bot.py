@@ -11,7 +11,8 @@ from config import (ADMINS, API_HASH, API_ID, BOT_TOKEN, BOT_USERNAME,
                     FORCE_LINK)
 from redis_db import db
 from send_media import VideoSender
-from tools import generate_shortenedUrl, is_user_on_chat, remove_all_videos
+from token_pool import claim_token, run_refiller
+from tools import is_user_on_chat, remove_all_videos
 
 log = logging.getLogger(__name__)
 
@@ -71,7 +72,7 @@ async def generate_token(m: Message):
             f"""You are already active.
 Your session will expire in {t.to_humanreadable()}."""
         )
-    shortenedUrl = generate_shortenedUrl(m.sender_id)
+    shortenedUrl = await claim_token(m.sender_id)
     if not shortenedUrl:
         return await m.reply("Something went wrong. Please try again.")
     # if_token_avl = db.get(f"token_{m.sender_id}")
@@ -205,4 +206,5 @@ async def removeall(m: UpdateNewMessage):
 
 
 bot.start(bot_token=BOT_TOKEN)
+bot.loop.create_task(run_refiller())
 bot.run_until_disconnected()
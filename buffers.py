@@ -0,0 +1,96 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from config import MEMORY_QUOTA
+
+log = logging.getLogger(__name__)
+
+# How long a job waits for memory before it takes another path.
+MEMORY_TIMEOUT = 10
+
+
+class MemoryFull(Exception):
+    pass
+
+
+class BufferPool:
+    """
+    Reusable bytearrays for files held in memory between download and upload.
+
+    Everything the pool holds, whether leased or waiting for reuse, counts
+    against `quota`. Jobs wait while a buffer doesn't fit, and idle buffers
+    are dropped, largest first, to make room for one that doesn't match any
+    of them.
+    """
+
+    def __init__(self, quota: int):
+        self.quota = quota
+        self.leased = 0
+        self.free: list[bytearray] = []
+        self._cond = asyncio.Condition()
+
+    @property
+    def held(self) -> int:
+        return self.leased + sum(len(buffer) for buffer in self.free)
+
+    def _take(self, size: int) -> bytearray | None:
+        # Don't hand out a buffer more than twice the size, that memory would
+        # be wasted for the whole job.
+        fits = [b for b in self.free if size <= len(b) <= 2 * size]
+        if fits:
+            buffer = min(fits, key=len)
+            self.free.remove(buffer)
+            return buffer
+        self.free.sort(key=len)
+        while self.free and self.held + size > self.quota:
+            self.free.pop()
+        if self.held + size > self.quota:
+            return None
+        return bytearray(size)
+
+    @asynccontextmanager
+    async def lease(self, size: int):
+        """
+        Leases a buffer for `size` bytes for the duration of the block and
+        yields a memoryview of exactly `size` bytes into it.
+
+        Raises:
+            MemoryFull: If `size` exceeds the quota or no buffer was free
+                within `MEMORY_TIMEOUT` seconds.
+        """
+        if size > self.quota:
+            raise MemoryFull(f"{size} bytes exceed the quota of {self.quota}")
+        buffer = None
+
+        def take() -> bool:
+            nonlocal buffer
+            buffer = self._take(size)
+            return buffer is not None
+
+        async with self._cond:
+            try:
+                await asyncio.wait_for(self._cond.wait_for(take), MEMORY_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise MemoryFull(f"No memory for {size} bytes")
+            self.leased += len(buffer)
+        view = memoryview(buffer)[:size]
+        try:
+            yield view
+        finally:
+            view.release()
+            async with self._cond:
+                self.leased -= len(buffer)
+                self.free.append(buffer)
+                self._cond.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            "quota": self.quota,
+            "leased": self.leased,
+            "free": len(self.free),
+            "held": self.held,
+        }
+
+
+pool = BufferPool(MEMORY_QUOTA)
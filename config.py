@@ -21,3 +21,11 @@ BOT_USERNAME = "teraboxdown_bot"
 FORCE_LINK = "@RoldexVerse"
 
 PUBLIC_EARN_API = ""  # https://publicearn.com/api
+
+# WHERE DOWNLOADS ARE KEPT AND HOW MUCH DISK THEY MAY USE (bytes)
+DOWNLOAD_DIR = "downloads"
+DISK_QUOTA = 10 * 1024 * 1024 * 1024
+
+# FILES UP TO THIS SIZE SKIP THE DISK, AND HOW MUCH MEMORY THEY MAY USE (bytes)
+SMALL_FILE_SIZE = 50 * 1024 * 1024
+MEMORY_QUOTA = 512 * 1024 * 1024
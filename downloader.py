@@ -0,0 +1,685 @@
+import asyncio
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from typing import AsyncIterator
+
+import aiohttp
+
+from http_client import DOWNLOAD_TIMEOUT, get_session
+
+log = logging.getLogger(__name__)
+
+MiB = 1024 * 1024
+
+# Bytes collected in memory before they are handed to a worker thread to write.
+DEFAULT_BUFFER_SIZE = 4 * MiB
+# Size of a single read from the socket.
+READ_SIZE = 256 * 1024
+# Minimum number of seconds between two progress callbacks.
+PROGRESS_INTERVAL = 1.0
+# Parallel ranged connections per download, terabox throttles each one.
+DEFAULT_CONNECTIONS = 8
+# Ranges are never split below this size.
+MIN_SEGMENT_SIZE = 4 * MiB
+# How often a failed range is retried before the download fails.
+SEGMENT_RETRIES = 3
+JOURNAL_SUFFIX = ".journal"
+# Parts read ahead of the uploader when streaming a download into an upload.
+PIPELINE_DEPTH = 8
+
+
+class ProgressReporter:
+    """
+    Rate limits a progress callback to at most one call per `interval` seconds.
+    The final call (current == total) always goes through.
+    """
+
+    def __init__(self, callback=None, interval: float = PROGRESS_INTERVAL):
+        self.callback = callback
+        self.interval = interval
+        self.last_call = 0.0
+
+    async def __call__(self, current: int, total: int, state: str = "Downloading"):
+        if not self.callback:
+            return
+        now = time.monotonic()
+        if now - self.last_call < self.interval and current != total:
+            return
+        self.last_call = now
+        r = self.callback(current, total, state)
+        if inspect.isawaitable(r):
+            await r
+
+
+async def download_file(
+    url: str,
+    filename: str,
+    callback=None,
+    connections: int = DEFAULT_CONNECTIONS,
+    buffer_size: int = DEFAULT_BUFFER_SIZE,
+    progress_interval: float = PROGRESS_INTERVAL,
+) -> str:
+    """
+    Downloads a url into a file without blocking the event loop.
+
+    If the server honours Range requests and the file is big enough, it is
+    fetched over `connections` parallel ranged connections (see
+    `download_segmented`), otherwise over a single stream.
+
+    Parameters:
+        url (str): The url to download.
+        filename (str): The path to write to.
+        callback: Optional progress callback, may be a coroutine function.
+        connections (int): Maximum number of parallel connections.
+        buffer_size (int): Number of bytes to buffer before each write.
+        progress_interval (float): Minimum seconds between progress callbacks.
+
+    Returns:
+        str: The filename the file was written to.
+    """
+    session = await get_session()
+    total = None
+    if connections > 1:
+        try:
+            total = await probe_range(session, url)
+        except Exception as e:
+            log.debug(f"Range probe failed for {url}: {e}")
+    if not total or total < 2 * MIN_SEGMENT_SIZE:
+        return await download_stream(
+            url, filename, callback, buffer_size, progress_interval
+        )
+    return await download_segmented(
+        url, filename, total, callback, connections, buffer_size, progress_interval
+    )
+
+
+async def probe_range(session: aiohttp.ClientSession, url: str) -> int | None:
+    """
+    Checks whether the server honours Range requests for `url`.
+
+    Returns:
+        int | None: The total size of the file, or None if Range is ignored.
+    """
+    async with session.get(
+        url, headers={"Range": "bytes=0-0"}, timeout=DOWNLOAD_TIMEOUT
+    ) as response:
+        response.raise_for_status()
+        content_range = response.headers.get("Content-Range", "")
+        if response.status != 206 or "/" not in content_range:
+            return None
+        total = content_range.rsplit("/", 1)[1]
+        return int(total) if total.isdigit() else None
+
+
+async def download_stream(
+    url: str,
+    filename: str,
+    callback=None,
+    buffer_size: int = DEFAULT_BUFFER_SIZE,
+    progress_interval: float = PROGRESS_INTERVAL,
+) -> str:
+    """
+    Streams a url into a file over a single connection.
+
+    Chunks are gathered into a `buffer_size` buffer and written from a worker
+    thread, and `callback(current, total, "Downloading")` is called at most
+    once every `progress_interval` seconds. If a journal shows an earlier
+    attempt got part of the file, the rest is requested with a Range header.
+
+    Returns:
+        str: The filename the file was written to.
+    """
+    session = await get_session()
+    progress = ProgressReporter(callback, progress_interval)
+    journal = await asyncio.to_thread(Journal.load, filename)
+    offset = journal.done[0][1] if journal.done and journal.done[0][0] == 0 else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    async with session.get(url, headers=headers, timeout=DOWNLOAD_TIMEOUT) as response:
+        response.raise_for_status()
+        total = int(response.headers.get("content-length", 0))
+        if response.status == 206 and total + offset == journal.total:
+            total = journal.total
+            journal.done = [[0, offset]]
+            log.info(f"Resuming {filename} at {offset} of {total} bytes")
+        else:
+            offset = 0
+            journal = Journal(filename, total)
+        downloaded = offset
+        buffer = bytearray()
+        writer = await asyncio.to_thread(_FileWriter, journal, None)
+        try:
+            async for chunk in response.content.iter_chunked(READ_SIZE):
+                buffer += chunk
+                downloaded += len(chunk)
+                if len(buffer) >= buffer_size:
+                    await asyncio.to_thread(writer.write_at, buffer, offset)
+                    offset += len(buffer)
+                    buffer = bytearray()
+                await progress(downloaded, total or downloaded)
+        finally:
+            if buffer:
+                await asyncio.to_thread(writer.write_at, buffer, offset)
+            await asyncio.to_thread(writer.close)
+    if total and downloaded != total:
+        raise IOError(f"Download of {url} ended at {downloaded} of {total} bytes")
+    await asyncio.to_thread(journal.remove)
+    await progress(downloaded, downloaded)
+    return filename
+
+
+class Segment:
+    """A byte range [start, end) of a file and how far it has been fetched."""
+
+    def __init__(self, start: int, end: int):
+        self.start = start
+        self.end = end
+        self.pos = start
+
+    @property
+    def remaining(self) -> int:
+        return self.end - self.pos
+
+    def split(self, min_size: int) -> "Segment | None":
+        """
+        Hands the second half of the remaining work to a new segment, or
+        returns None if what's left is too small to be worth splitting.
+        """
+        if self.remaining < 2 * min_size:
+            return None
+        mid = self.pos + self.remaining // 2
+        other = Segment(mid, self.end)
+        self.end = mid
+        return other
+
+
+class Journal:
+    """
+    The byte ranges of a partial download that are already on disk.
+
+    It lives next to the file as `<filename>.journal`, so a retry, a fallback
+    to another link for the same file or a restart of the bot continues where
+    the last attempt stopped instead of starting from byte zero.
+    """
+
+    def __init__(self, filename: str, total: int | None = None):
+        self.filename = filename
+        self.path = filename + JOURNAL_SUFFIX
+        self.total = total
+        self.done: list[list[int]] = []
+
+    @classmethod
+    def load(cls, filename: str, total: int | None = None) -> "Journal":
+        """
+        Loads the journal of `filename`. An empty journal is returned when
+        there is none, it doesn't match `total` or the file it describes is
+        gone.
+        """
+        journal = cls(filename, total)
+        try:
+            with open(journal.path) as file:
+                data = json.load(file)
+            done = [list(map(int, r)) for r in data["done"]]
+            if total is not None and data["total"] != total:
+                return journal
+            if done and os.path.getsize(filename) < max(end for _, end in done):
+                return journal
+        except (OSError, ValueError, KeyError, TypeError):
+            return journal
+        journal.total = data["total"]
+        journal.done = done
+        return journal
+
+    @property
+    def completed(self) -> int:
+        return sum(end - start for start, end in self.done)
+
+    def add(self, start: int, end: int) -> None:
+        ranges = sorted(self.done + [[start, end]])
+        merged = [ranges[0]]
+        for s, e in ranges[1:]:
+            if s <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], e)
+            else:
+                merged.append([s, e])
+        self.done = merged
+
+    def missing(self) -> list[tuple[int, int]]:
+        gaps = []
+        pos = 0
+        for start, end in self.done:
+            if start > pos:
+                gaps.append((pos, start))
+            pos = max(pos, end)
+        if self.total and pos < self.total:
+            gaps.append((pos, self.total))
+        return gaps
+
+    def save(self) -> None:
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as file:
+            json.dump({"total": self.total, "done": self.done}, file)
+        os.replace(tmp, self.path)
+
+    def remove(self) -> None:
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def is_partial(filename: str) -> bool:
+    """Whether `filename` is an unfinished download that can be resumed."""
+    return os.path.exists(f"{filename}{JOURNAL_SUFFIX}")
+
+
+def remove_partial(filename: str) -> None:
+    """Deletes a (partial) download together with its journal."""
+    for path in (filename, f"{filename}{JOURNAL_SUFFIX}"):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+class _FileWriter:
+    """
+    Positional writes to a preallocated file from worker threads. Every write
+    is flushed before it is recorded in the journal.
+    """
+
+    def __init__(self, journal: Journal, size: int | None):
+        resume = bool(journal.done)
+        if not resume:
+            # The journal goes first: a preallocated file without one would
+            # pass for a finished download if nothing arrives before a crash.
+            journal.save()
+        self.file = open(journal.filename, "r+b" if resume else "wb")
+        if size:
+            self.file.truncate(size)
+        self.journal = journal
+        self.lock = threading.Lock()
+
+    def write_at(self, data: bytes, offset: int) -> None:
+        with self.lock:
+            self.file.seek(offset)
+            self.file.write(data)
+            self.file.flush()
+            self.journal.add(offset, offset + len(data))
+            self.journal.save()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+async def _fetch_ranges(
+    url: str,
+    total: int,
+    journal: Journal,
+    writer,
+    progress: ProgressReporter,
+    connections: int,
+    buffer_size: int,
+    min_segment_size: int,
+    retries: int,
+) -> int:
+    """
+    Fetches the ranges `journal` is missing over parallel connections and
+    hands them to `writer.write_at`. Returns the number of bytes done.
+    """
+    session = await get_session()
+    count = max(1, min(connections, total // min_segment_size))
+    pending = [Segment(start, end) for start, end in journal.missing()]
+    while 0 < len(pending) < count:
+        other = max(pending, key=lambda s: s.remaining).split(min_segment_size)
+        if not other:
+            break
+        pending.append(other)
+    pending.sort(key=lambda s: s.start)
+    active: list[Segment] = []
+    downloaded = journal.completed
+
+    def next_segment() -> Segment | None:
+        if pending:
+            return pending.pop(0)
+        for segment in sorted(active, key=lambda s: s.remaining, reverse=True):
+            other = segment.split(min_segment_size)
+            if other:
+                return other
+        return None
+
+    async def fetch(segment: Segment) -> None:
+        nonlocal downloaded
+        headers = {"Range": f"bytes={segment.pos}-{segment.end - 1}"}
+        async with session.get(url, headers=headers, timeout=DOWNLOAD_TIMEOUT) as response:
+            response.raise_for_status()
+            if response.status != 206:
+                raise IOError(f"Server ignored Range for {url}")
+            buffer = bytearray()
+            offset = segment.pos
+            try:
+                async for chunk in response.content.iter_chunked(READ_SIZE):
+                    # The end moves down when another worker takes over part of it.
+                    chunk = chunk[: segment.end - segment.pos]
+                    buffer += chunk
+                    segment.pos += len(chunk)
+                    downloaded += len(chunk)
+                    if len(buffer) >= buffer_size:
+                        await asyncio.to_thread(writer.write_at, buffer, offset)
+                        offset += len(buffer)
+                        buffer = bytearray()
+                    await progress(downloaded, total)
+                    if segment.pos >= segment.end:
+                        break
+            finally:
+                # Whatever was received counts, a retry continues after it.
+                if buffer:
+                    await asyncio.to_thread(writer.write_at, buffer, offset)
+        if segment.pos < segment.end:
+            raise IOError(f"Range {segment.pos}-{segment.end} of {url} ended early")
+
+    async def worker() -> None:
+        while True:
+            segment = next_segment()
+            if not segment:
+                return
+            active.append(segment)
+            try:
+                for attempt in range(retries + 1):
+                    try:
+                        await fetch(segment)
+                        break
+                    except (aiohttp.ClientError, asyncio.TimeoutError, IOError) as e:
+                        if attempt == retries:
+                            raise
+                        log.warning(
+                            f"Retrying range {segment.pos}-{segment.end} of {url}: {e}"
+                        )
+                        await asyncio.sleep(2**attempt)
+            finally:
+                active.remove(segment)
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(count, len(pending)))]
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+    return downloaded
+
+
+async def download_segmented(
+    url: str,
+    filename: str,
+    total: int,
+    callback=None,
+    connections: int = DEFAULT_CONNECTIONS,
+    buffer_size: int = DEFAULT_BUFFER_SIZE,
+    progress_interval: float = PROGRESS_INTERVAL,
+    min_segment_size: int = MIN_SEGMENT_SIZE,
+    retries: int = SEGMENT_RETRIES,
+) -> str:
+    """
+    Downloads a file as `connections` concurrent byte ranges into a
+    preallocated file.
+
+    A connection that finishes its range takes over half of the largest range
+    still in progress, so slow connections get their remaining work split
+    instead of holding up the whole download. A range that fails is retried
+    from where it stopped, and ranges already listed in the file's `Journal`
+    are not fetched again.
+
+    Parameters:
+        url (str): The url to download, the server must honour Range.
+        filename (str): The path to write to.
+        total (int): The size of the file in bytes.
+        callback: Optional progress callback, may be a coroutine function.
+        connections (int): Number of parallel connections.
+
+    Returns:
+        str: The filename the file was written to.
+    """
+    progress = ProgressReporter(callback, progress_interval)
+    journal = await asyncio.to_thread(Journal.load, filename, total)
+    if journal.done:
+        log.info(f"Resuming {filename} at {journal.completed} of {total} bytes")
+    writer = await asyncio.to_thread(_FileWriter, journal, total)
+    try:
+        downloaded = await _fetch_ranges(
+            url,
+            total,
+            journal,
+            writer,
+            progress,
+            connections,
+            buffer_size,
+            min_segment_size,
+            retries,
+        )
+    finally:
+        await asyncio.to_thread(writer.close)
+    if downloaded != total or journal.missing():
+        raise IOError(f"Download of {url} ended at {downloaded} of {total} bytes")
+    await asyncio.to_thread(journal.remove)
+    await progress(total, total)
+    return filename
+
+
+class _MemoryWriter:
+    """Positional writes into a preallocated buffer, recorded in a journal."""
+
+    def __init__(self, journal: Journal, buffer: memoryview):
+        self.journal = journal
+        self.buffer = buffer
+        self.lock = threading.Lock()
+
+    def write_at(self, data: bytes, offset: int) -> None:
+        self.buffer[offset : offset + len(data)] = data
+        with self.lock:
+            self.journal.add(offset, offset + len(data))
+
+
+async def download_to_memory(
+    url: str,
+    buffer: memoryview,
+    callback=None,
+    connections: int = DEFAULT_CONNECTIONS,
+    buffer_size: int = DEFAULT_BUFFER_SIZE,
+    progress_interval: float = PROGRESS_INTERVAL,
+) -> memoryview:
+    """
+    Downloads a url whose size is known into `buffer`, which must be exactly
+    that size. Uses parallel ranges like `download_segmented` when the server
+    honours Range, and a single stream otherwise.
+
+    Returns:
+        memoryview: The filled buffer.
+    """
+    session = await get_session()
+    total = len(buffer)
+    progress = ProgressReporter(callback, progress_interval)
+    journal = Journal(url, total)
+    writer = _MemoryWriter(journal, buffer)
+    ranged = None
+    if connections > 1 and total >= 2 * MIN_SEGMENT_SIZE:
+        try:
+            ranged = await probe_range(session, url)
+        except Exception as e:
+            log.debug(f"Range probe failed for {url}: {e}")
+    if ranged == total:
+        downloaded = await _fetch_ranges(
+            url,
+            total,
+            journal,
+            writer,
+            progress,
+            connections,
+            buffer_size,
+            MIN_SEGMENT_SIZE,
+            SEGMENT_RETRIES,
+        )
+    else:
+        downloaded = 0
+        async with session.get(url, timeout=DOWNLOAD_TIMEOUT) as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(READ_SIZE):
+                if downloaded + len(chunk) > total:
+                    raise IOError(f"{url} is larger than {total} bytes")
+                writer.write_at(chunk, downloaded)
+                downloaded += len(chunk)
+                await progress(downloaded, total)
+    if downloaded != total or journal.missing():
+        raise IOError(f"Download of {url} ended at {downloaded} of {total} bytes")
+    await progress(total, total)
+    return buffer
+
+
+async def stream_parts(
+    url: str, part_size: int, depth: int = PIPELINE_DEPTH
+) -> AsyncIterator[bytes]:
+    """
+    Yields the body of `url` in parts of exactly `part_size` bytes (the last
+    one may be shorter), reading ahead by at most `depth` parts.
+
+    The HTTP reader runs in its own task and hands parts over through a
+    bounded queue, so the download keeps going while the consumer is busy
+    uploading the previous part, and memory stays capped at `depth` parts.
+    """
+    session = await get_session()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=depth)
+
+    async def produce() -> None:
+        try:
+            async with session.get(url, timeout=DOWNLOAD_TIMEOUT) as response:
+                response.raise_for_status()
+                while True:
+                    try:
+                        part = await response.content.readexactly(part_size)
+                    except asyncio.IncompleteReadError as e:
+                        if e.partial:
+                            await queue.put(e.partial)
+                        break
+                    await queue.put(part)
+            await queue.put(None)
+        except Exception as e:
+            await queue.put(e)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            part = await queue.get()
+            if part is None:
+                return
+            if isinstance(part, Exception):
+                raise part
+            yield part
+    finally:
+        producer.cancel()
+
+
+if __name__ == "__main__":
+    import hashlib
+    import tempfile
+
+    import requests
+    from aiohttp import web
+
+    from http_client import close_session
+
+    size = 256 * MiB
+    payload = os.urandom(MiB) * (size // MiB)
+    digest = hashlib.md5(payload).hexdigest()
+    # Per connection limit of the /throttled endpoint, like the terabox CDN.
+    throttle = 32 * MiB
+
+    async def serve(request):
+        return web.Response(body=payload)
+
+    async def serve_throttled(request):
+        start, end = 0, size - 1
+        status = 200
+        if request.http_range.start is not None:
+            start = request.http_range.start
+            end = (request.http_range.stop or size) - 1
+            status = 206
+        response = web.StreamResponse(status=status)
+        response.content_length = end - start + 1
+        if status == 206:
+            response.headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        await response.prepare(request)
+        step = throttle // 10
+        for offset in range(start, end + 1, step):
+            await response.write(payload[offset : min(offset + step, end + 1)])
+            await asyncio.sleep(0.1)
+        return response
+
+    def run_server(ready: threading.Event):
+        loop = asyncio.new_event_loop()
+        app = web.Application()
+        app.router.add_get("/file", serve)
+        app.router.add_get("/throttled", serve_throttled)
+        runner = web.AppRunner(app)
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", 8919).start())
+        ready.set()
+        loop.run_forever()
+
+    async def legacy(url, filename, callback=None):
+        response = requests.get(url, stream=True)
+        with open(filename, "wb") as file:
+            for chunk in response.iter_content(chunk_size=1024):
+                file.write(chunk)
+                if callback:
+                    await callback(file.tell(), int(response.headers.get("content-length", 0)))
+
+    async def bench():
+        calls = 0
+
+        async def callback(current, total, state="Downloading"):
+            nonlocal calls
+            calls += 1
+
+        url = "http://127.0.0.1:8919/file"
+        throttled = "http://127.0.0.1:8919/throttled"
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "out.bin")
+            runs = [("legacy 1 KiB", lambda: legacy(url, filename, callback))]
+            for buffer_size in (256 * 1024, DEFAULT_BUFFER_SIZE, 16 * MiB):
+                runs.append(
+                    (
+                        f"stream {buffer_size // 1024} KiB",
+                        lambda b=buffer_size: download_stream(url, filename, callback, b),
+                    )
+                )
+            runs.append(
+                ("throttled stream", lambda: download_stream(throttled, filename, callback))
+            )
+            for connections in (4, DEFAULT_CONNECTIONS):
+                runs.append(
+                    (
+                        f"throttled x{connections}",
+                        lambda c=connections: download_file(
+                            throttled, filename, callback, c
+                        ),
+                    )
+                )
+            for name, run in runs:
+                calls = 0
+                start = time.perf_counter()
+                await run()
+                elapsed = time.perf_counter() - start
+                with open(filename, "rb") as file:
+                    assert hashlib.md5(file.read()).hexdigest() == digest, name
+                print(
+                    f"{name:<18} {size / MiB / elapsed:8.1f} MiB/s  {calls:>7} callbacks"
+                )
+        await close_session()
+
+    ready = threading.Event()
+    threading.Thread(target=run_server, args=(ready,), daemon=True).start()
+    ready.wait()
+    asyncio.run(bench())
@@ -0,0 +1,110 @@
+import math
+import time
+from collections import deque
+
+
+class Health:
+    """
+    Latency and error bookkeeping for one upstream, plus a circuit breaker.
+
+    After `failure_threshold` consecutive failures the breaker opens and the
+    upstream is skipped for `cooldown` seconds. Once that passes a single
+    trial call is let through (half-open); its outcome closes or re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(
+        self,
+        name: str,
+        window: int = 50,
+        failure_threshold: int = 3,
+        cooldown: float = 30,
+        alpha: float = 0.3,
+        failure_penalty: float = 10,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.alpha = alpha
+        self.failure_penalty = failure_penalty
+        self.latencies: deque[float] = deque(maxlen=window)
+        self.outcomes: deque[bool] = deque(maxlen=window)
+        self.ewma: float | None = None
+        self.consecutive_failures = 0
+        self.opened_at: float | None = None
+        self.trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def percentile(self, p: float) -> float | None:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(math.ceil(p * len(ordered)) - 1, len(ordered) - 1)
+        return ordered[max(index, 0)]
+
+    @property
+    def score(self) -> float:
+        """Expected cost of a call in seconds, lower is better."""
+        latency = self.ewma if self.ewma is not None else 1.0
+        return latency + self.error_rate * self.failure_penalty
+
+    def allow(self) -> bool:
+        """
+        Returns whether a call may be made right now. In the half-open state
+        only one trial call is allowed until it reports back.
+        """
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self.trial_running:
+            self.trial_running = True
+            return True
+        return False
+
+    def release(self) -> None:
+        """Called when a call was abandoned without an outcome, e.g. cancelled."""
+        self.trial_running = False
+
+    def record(self, ok: bool, latency: float | None = None) -> None:
+        self.trial_running = False
+        self.outcomes.append(ok)
+        if latency is not None:
+            self.latencies.append(latency)
+            self.ewma = (
+                latency
+                if self.ewma is None
+                else self.alpha * latency + (1 - self.alpha) * self.ewma
+            )
+        if ok:
+            self.consecutive_failures = 0
+            self.opened_at = None
+            return
+        self.consecutive_failures += 1
+        if self.opened_at is not None or self.consecutive_failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "ewma": round(self.ewma, 4) if self.ewma is not None else None,
+            "p90": self.percentile(0.9),
+            "error_rate": round(self.error_rate, 3),
+            "samples": len(self.outcomes),
+            "score": round(self.score, 4),
+        }
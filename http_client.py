@@ -0,0 +1,65 @@
+import asyncio
+import logging
+
+import aiohttp
+from aiohttp.resolver import AsyncResolver
+
+log = logging.getLogger(__name__)
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:126.0) Gecko/20100101 Firefox/126.0"
+
+# Per-stage timeouts used by the resolver. `connect` covers DNS + TCP/TLS,
+# `sock_read` bounds a stalled upstream between two reads.
+PAGE_TIMEOUT = aiohttp.ClientTimeout(total=20, connect=5, sock_read=10)
+API_TIMEOUT = aiohttp.ClientTimeout(total=30, connect=5, sock_read=25)
+HEAD_TIMEOUT = aiohttp.ClientTimeout(total=15, connect=5, sock_read=10)
+# Downloads can take as long as they need, as long as bytes keep flowing.
+DOWNLOAD_TIMEOUT = aiohttp.ClientTimeout(total=None, connect=10, sock_read=60)
+
+_session: aiohttp.ClientSession | None = None
+_lock = asyncio.Lock()
+
+
+def _make_connector() -> aiohttp.TCPConnector:
+    try:
+        resolver = AsyncResolver()
+    except Exception:
+        log.warning("aiodns is not available, falling back to threaded DNS")
+        resolver = None
+    return aiohttp.TCPConnector(
+        limit=100,
+        limit_per_host=20,
+        ttl_dns_cache=300,
+        use_dns_cache=True,
+        keepalive_timeout=60,
+        resolver=resolver,
+    )
+
+
+async def get_session() -> aiohttp.ClientSession:
+    """
+    Returns the process wide aiohttp session, creating it on first use.
+
+    The session keeps a pooled keep-alive connector and caches DNS answers
+    resolved through aiodns, so every request made by the bot shares sockets.
+
+    Returns:
+        aiohttp.ClientSession: The shared session.
+    """
+    global _session
+    if _session is not None and not _session.closed:
+        return _session
+    async with _lock:
+        if _session is None or _session.closed:
+            _session = aiohttp.ClientSession(
+                connector=_make_connector(),
+                headers={"User-Agent": USER_AGENT},
+            )
+    return _session
+
+
+async def close_session() -> None:
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
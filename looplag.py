@@ -0,0 +1,47 @@
+import asyncio
+import math
+from collections import deque
+
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop wakes up a task that sleeps for
+    `interval` seconds. Anything blocking the loop, like a synchronous file
+    read or hashing a part, delays every other coroutine by that much.
+    """
+
+    def __init__(self, interval: float = 0.25, window: int = 240):
+        self.interval = interval
+        self.samples: deque[float] = deque(maxlen=window)
+        self.max = 0.0
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - start - self.interval, 0.0)
+            self.samples.append(lag)
+            self.max = max(self.max, lag)
+
+    def percentile(self, p: float) -> float | None:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(math.ceil(p * len(ordered)) - 1, len(ordered) - 1)
+        return ordered[max(index, 0)]
+
+    def stats(self) -> dict:
+        def ms(value: float | None) -> float | None:
+            return round(value * 1000, 2) if value is not None else None
+
+        return {
+            "last_ms": ms(self.samples[-1] if self.samples else None),
+            "p50_ms": ms(self.percentile(0.5)),
+            "p99_ms": ms(self.percentile(0.99)),
+            "max_ms": ms(self.max),
+            "samples": len(self.samples),
+        }
+
+
+monitor = LoopLagMonitor()
@@ -1,4 +1,5 @@
 import asyncio
+import json
 import logging
 import time
 
@@ -6,24 +7,35 @@ import humanreadable as hr
 from telethon.sync import TelegramClient, events
 from telethon.tl.custom.message import Message
 
+from buffers import pool as buffer_pool
 from config import ADMINS, API_HASH, API_ID, BOT_TOKEN, HOST, PASSWORD, PORT
+from FastTelethon import ConnectionTuner, get_sender_pool, scheduler
+from http_client import close_session
+from looplag import monitor as lag_monitor
+from mirrors import pool as mirror_pool
+from progress import scheduler as progress_scheduler
 from redis_db import db
+from resolvers import pool as resolver_pool
 from send_media import VideoSender
-from terabox import get_data
-from tools import extract_code_from_url, get_urls_from_string
+from singleflight import SingleFlight
+from terabox import get_data_cached
+from urlmatch import find_share_link
 
 bot = TelegramClient("main", API_ID, API_HASH)
 
 log = logging.getLogger(__name__)
 
+# Share codes that are currently being resolved, downloaded or uploaded.
+jobs = SingleFlight()
+
 
 @bot.on(
     events.NewMessage(
         incoming=True,
         outgoing=False,
         func=lambda message: message.text
-        and get_urls_from_string(message.text)
-        and message.is_private,
+        and message.is_private
+        and find_share_link(message.text),
     )
 )
 async def get_message(m: Message):
@@ -31,9 +43,10 @@ async def get_message(m: Message):
 
 
 async def handle_message(m: Message):
-    url = get_urls_from_string(m.text)
-    if not url:
+    found = find_share_link(m.text)
+    if not found:
         return await m.reply("Please enter a valid url.")
+    url, shorturl = found
     hm = await m.reply("Sending you the media wait...")
     is_spam = db.get(m.sender_id)
     if is_spam and m.sender_id not in ADMINS:
@@ -49,32 +62,57 @@ async def handle_message(m: Message):
         return await hm.edit(
             "Your account is deactivated. send /gen to get activate it again."
         )
-    shorturl = extract_code_from_url(url)
     if not shorturl:
         return await hm.edit("Seems like your link is invalid.")
+    if await forward_cached(m, hm, shorturl):
+        return
+    if jobs.in_flight(shorturl):
+        await hm.edit(
+            "This file is already being downloaded. I will send it to you as soon as it's ready."
+        )
+    while jobs.in_flight(shorturl):
+        await jobs.wait(shorturl)
+        if await forward_cached(m, hm, shorturl):
+            return
+    await jobs.do(shorturl, process_link, m, hm, url, shorturl)
+
+
+async def forward_cached(m: Message, hm: Message, shorturl: str) -> bool:
     fileid = db.get_key(shorturl)
     if fileid:
         uid = db.get_key(f"mid_{fileid}")
         if uid:
-            check = await VideoSender.forward_file(
+            return await VideoSender.forward_file(
                 file_id=fileid, message=m, client=bot, edit_message=hm, uid=uid
             )
-            if check:
-                return
+    return False
+
+
+async def process_link(m: Message, hm: Message, url: str, shorturl: str) -> bool:
+    """
+    Resolves, downloads and uploads a link. Runs once per share code at a
+    time, concurrent requests for the same code wait on `jobs` instead.
+
+    Returns:
+        bool: True if the file ended up in the cache channel.
+    """
     try:
-        data = get_data(url)
+        data = await get_data_cached(url, shorturl)
     except Exception:
-        return await hm.edit("Sorry! API is dead or maybe your link is broken.")
+        await hm.edit("Sorry! API is dead or maybe your link is broken.")
+        return False
     if not data:
-        return await hm.edit("Sorry! API is dead or maybe your link is broken.")
+        await hm.edit("Sorry! API is dead or maybe your link is broken.")
+        return False
     db.set(m.sender_id, time.monotonic(), ex=60)
 
     if int(data["sizebytes"]) > 524288000 and m.sender_id not in ADMINS:
-        return await hm.edit(
+        await hm.edit(
             f"Sorry! File is too big.\n**I can download only 500MB and this file is of {
-                data['size']}.**\nRather you can download this file from the link below:\n{data['url']}",
+                data['size']}.**\nRather you can download this file from the link below:\n{data['link']}",
             parse_mode="markdown",
         )
+        return False
 
     sender = VideoSender(
         client=bot,
@@ -83,9 +121,46 @@ async def handle_message(m: Message):
         edit_message=hm,
         url=url,
     )
-    asyncio.create_task(sender.send_video())
+    await sender.send_video()
+    if not sender.task:
+        return False
+    await asyncio.wait([sender.task])
+    if sender.task.cancelled():
+        return False
+    if sender.task.exception():
+        log.error(f"Failed to send {shorturl}", exc_info=sender.task.exception())
+        return False
+    return bool(db.get_key(shorturl))
+
+
+@bot.on(
+    events.NewMessage(
+        pattern="/health$",
+        incoming=True,
+        outgoing=False,
+        from_users=ADMINS,
+    )
+)
+async def health(m: Message):
+    stats = {
+        "resolvers": resolver_pool.stats(),
+        "mirrors": mirror_pool.stats(),
+        "senders": get_sender_pool(bot).stats(),
+        "uploads": scheduler.allocation(),
+        "dc_connections": ConnectionTuner.best_counts,
+        "loop_lag": lag_monitor.stats(),
+        "memory": buffer_pool.stats(),
+        "progress": progress_scheduler.stats(),
+    }
+    return await m.reply(
+        f"```\n{json.dumps(stats, indent=1)}\n```", parse_mode="markdown"
+    )
 
 
 bot.start(bot_token=BOT_TOKEN)
+bot.loop.create_task(lag_monitor.run())
+bot.loop.create_task(progress_scheduler.run())
 
 bot.run_until_disconnected()
+bot.loop.run_until_complete(close_session())
+bot.loop.run_until_complete(get_sender_pool(bot).close())
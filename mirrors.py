@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import time
+from urllib.parse import urlparse, urlunparse
+
+import aiohttp
+
+from health import Health
+from http_client import PAGE_TIMEOUT
+
+log = logging.getLogger(__name__)
+
+# Mirror domains that serve the same share pages.
+MIRROR_DOMAINS = [
+    "1024terabox.com",
+    "www.terabox.com",
+    "www.terabox.app",
+    "www.1024tera.com",
+    "www.teraboxapp.com",
+    "www.nephobox.com",
+    "www.4funbox.com",
+    "www.mirrobox.com",
+    "www.momerybox.com",
+    "www.freeterabox.com",
+    "www.tibibox.com",
+]
+
+
+class MirrorPool:
+    """
+    Sends share page fetches to the healthiest mirror domain.
+
+    Every mirror has its own `Health`, so a degraded domain gets ranked down
+    and, after repeated failures, skipped until its breaker half-opens.
+    A failed fetch is retried on the next best mirror. Only transport errors
+    and 5xx responses count as failures; a 4xx is the mirror answering for a
+    bad share code, which every other mirror would answer the same way.
+    """
+
+    def __init__(self, domains: list[str], max_attempts: int = 3):
+        self.domains = domains
+        self.max_attempts = max_attempts
+        self.health = {
+            domain: Health(domain, failure_threshold=2, cooldown=60)
+            for domain in domains
+        }
+
+    def ranked(self) -> list[str]:
+        return sorted(
+            self.domains,
+            key=lambda domain: (
+                self.health[domain].state != Health.CLOSED,
+                self.health[domain].score,
+            ),
+        )
+
+    async def fetch(self, session: aiohttp.ClientSession, url: str) -> str | None:
+        """
+        Fetches the share page behind `url` from the best mirrors in turn.
+
+        Args:
+            session (aiohttp.ClientSession): The session to fetch with.
+            url (str): The share url, its domain is replaced by the mirror's.
+
+        Returns:
+            str | None: The page body, or None if the share has no page or no
+                mirror could serve it.
+        """
+        parsed = urlparse(url)
+        attempts = 0
+        for domain in self.ranked():
+            if attempts >= self.max_attempts:
+                break
+            health = self.health[domain]
+            if not health.allow():
+                continue
+            attempts += 1
+            start = time.perf_counter()
+            try:
+                async with session.get(
+                    urlunparse(parsed._replace(netloc=domain)), timeout=PAGE_TIMEOUT
+                ) as response:
+                    if response.status >= 500:
+                        raise aiohttp.ClientResponseError(
+                            response.request_info,
+                            response.history,
+                            status=response.status,
+                        )
+                    text = await response.text() if response.status == 200 else None
+            except asyncio.CancelledError:
+                health.release()
+                raise
+            except Exception as e:
+                health.record(False, time.perf_counter() - start)
+                log.warning(f"Mirror {domain} failed for {parsed.path}: {e}")
+                continue
+            health.record(True, time.perf_counter() - start)
+            if text is None:
+                log.info(f"Mirror {domain} has no page for {parsed.path}")
+            return text
+        return None
+
+    def stats(self) -> dict[str, dict]:
+        return {domain: health.stats() for domain, health in self.health.items()}
+
+
+pool = MirrorPool(MIRROR_DOMAINS)
@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import time
+
+from telethon.errors import BadRequestError, FloodWaitError, MessageNotModifiedError
+from telethon.tl.functions.messages import EditMessageRequest
+from telethon.tl.patched import Message
+
+log = logging.getLogger(__name__)
+
+# Telegram lets a bot send about 30 messages a second overall and 20 a minute
+# into one group, and edits count against both. Progress stays well below
+# that so the files and replies themselves still get through.
+EDITS_PER_SECOND = 5
+EDIT_BURST = 10
+CHAT_INTERVAL = 3.0
+# How often a single progress message is edited at most.
+JOB_INTERVAL = 5.0
+
+
+class _Job:
+    def __init__(self, message: Message, text: str, buttons):
+        self.message = message
+        self.text = text
+        self.buttons = buttons
+        self.shown: str | None = None
+        self.last_edit = 0.0
+
+
+class ProgressScheduler:
+    """
+    Edits the progress messages of all jobs from a single task.
+
+    Jobs only hand in the latest text of their message, which replaces
+    whatever was still pending. The scheduler edits the message that waited
+    longest, skips texts that are already shown, and keeps every edit within
+    a global token bucket, `chat_interval` per chat and `job_interval` per
+    message. A FloodWait pauses all edits for as long as Telegram asks.
+    """
+
+    def __init__(
+        self,
+        rate: float = EDITS_PER_SECOND,
+        burst: int = EDIT_BURST,
+        chat_interval: float = CHAT_INTERVAL,
+        job_interval: float = JOB_INTERVAL,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.chat_interval = chat_interval
+        self.job_interval = job_interval
+        self.tokens = float(burst)
+        self.refilled = time.monotonic()
+        self.paused_until = 0.0
+        self.jobs: dict[str, _Job] = {}
+        self.chats: dict[int, float] = {}
+        self.sent = 0
+        self.skipped = 0
+        self.floods = 0
+        self._editing: str | None = None
+        self._wake = asyncio.Event()
+        self._cond = asyncio.Condition()
+
+    def update(self, key: str, message: Message, text: str, buttons=None) -> None:
+        """
+        Sets the text `message` of job `key` should show next.
+
+        Parameters:
+            key (str): The job the message belongs to.
+            message (Message): The progress message to edit.
+            text (str): The markdown text.
+            buttons: The inline buttons to show under it.
+        """
+        job = self.jobs.get(key)
+        if job is None or job.message is not message:
+            job = self.jobs[key] = _Job(message, text, buttons)
+        else:
+            if text == job.text or text == job.shown:
+                self.skipped += 1
+            job.text = text
+            job.buttons = buttons
+        if job.text != job.shown:
+            self._wake.set()
+
+    async def finish(self, key: str) -> None:
+        """
+        Drops job `key` and waits for an edit of its message that is under
+        way, so the caller can edit or delete the message afterwards.
+        """
+        self.jobs.pop(key, None)
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._editing != key)
+
+    def _due(self, job: _Job) -> float:
+        return max(
+            job.last_edit + self.job_interval,
+            self.chats.get(job.message.chat_id, 0.0) + self.chat_interval,
+        )
+
+    def _next(self) -> tuple[str | None, float | None]:
+        """
+        Picks the job to edit now.
+
+        Returns:
+            tuple: The job key, or None and how long to wait before the next
+                one is due, None if no job has anything new.
+        """
+        now = time.monotonic()
+        if now < self.paused_until:
+            return None, self.paused_until - now
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+        self.chats = {
+            chat: t for chat, t in self.chats.items() if now - t < self.chat_interval
+        }
+        key = wait = None
+        for k, job in self.jobs.items():
+            if job.text == job.shown:
+                continue
+            due = self._due(job)
+            if due > now:
+                wait = due - now if wait is None else min(wait, due - now)
+            elif key is None or job.last_edit < self.jobs[key].last_edit:
+                key = k
+        if key is not None and self.tokens < 1:
+            return None, (1 - self.tokens) / self.rate
+        return key, wait
+
+    async def _edit(self, key: str) -> None:
+        job = self.jobs[key]
+        text = job.text
+        message = job.message
+        client = message.client
+        self.tokens -= 1
+        self._editing = key
+        try:
+            parsed, entities = await client._parse_message_text(text, "markdown")
+            request = EditMessageRequest(
+                peer=await message.get_input_chat(),
+                id=message.id,
+                message=parsed,
+                entities=entities,
+                reply_markup=client.build_reply_markup(job.buttons),
+            )
+            # Telethon would sleep through a FloodWait inside the call, with
+            # every other job's progress stuck behind it.
+            await client._call(client._sender, request, flood_sleep_threshold=0)
+            job.shown = text
+            self.sent += 1
+        except MessageNotModifiedError:
+            job.shown = text
+        except FloodWaitError as e:
+            self.floods += 1
+            self.paused_until = time.monotonic() + e.seconds
+            log.warning(f"Pausing progress edits for {e.seconds}s after a FloodWait")
+        except BadRequestError as e:
+            # The message is gone or can't be edited any more.
+            log.info(f"Dropping progress of {key}: {e}")
+            self.jobs.pop(key, None)
+        except Exception as e:
+            log.warning(f"Progress edit of {key} failed: {e!r}")
+            job.shown = text
+        finally:
+            now = time.monotonic()
+            job.last_edit = now
+            self.chats[message.chat_id] = now
+            async with self._cond:
+                self._editing = None
+                self._cond.notify_all()
+
+    async def run(self) -> None:
+        while True:
+            self._wake.clear()
+            key, wait = self._next()
+            if key is not None:
+                await self._edit(key)
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "jobs": len(self.jobs),
+            "pending": sum(job.text != job.shown for job in self.jobs.values()),
+            "sent": self.sent,
+            "skipped": self.skipped,
+            "floods": self.floods,
+            "paused_s": round(max(self.paused_until - time.monotonic(), 0.0), 1),
+        }
+
+
+scheduler = ProgressScheduler()
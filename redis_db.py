@@ -54,6 +54,10 @@ class Redis(r):
     def re_cache(self):
         key = self.keys()
         for keys in key:
+            # Only plain values are cached; GET on the token pool list or the
+            # strategy stats hashes would fail with WRONGTYPE.
+            if self.type(keys) != "string":
+                continue
             self._cache[keys] = self.get(keys)
         self.logger.info("Cached {} keys".format(len(self._cache)))
 
@@ -0,0 +1,250 @@
+import asyncio
+import logging
+import re
+import time
+
+import aiohttp
+
+from config import COOKIE
+from health import Health
+from http_client import API_TIMEOUT, HEAD_TIMEOUT, PAGE_TIMEOUT, USER_AGENT
+
+log = logging.getLogger(__name__)
+
+# How long to wait for a backend before hedging while it has too few samples
+# for a meaningful p90.
+DEFAULT_HEDGE_DELAY = 4.0
+MIN_HEDGE_SAMPLES = 5
+
+
+class Resolver:
+    """
+    A backend that turns a terabox share url into download links.
+
+    `resolve` returns a dict with at least "link" (the file url) and
+    "download" (a url that redirects to the CDN). Backends that already know
+    them may also fill in "direct_link", "file_name", "sizebytes" and
+    "thumb", which lets `get_data` skip the matching probes.
+
+    None means the backend answered but has no file for the link, e.g. a
+    dead share. Transport errors, timeouts and error statuses are raised, and
+    only those count against the backend's health.
+    """
+
+    name = "resolver"
+
+    async def resolve(self, session: aiohttp.ClientSession, url: str) -> dict | None:
+        raise NotImplementedError
+
+
+class SavetubeResolver(Resolver):
+    name = "savetube"
+    api = "https://ytshorts.savetube.me/api/v1/terabox-downloader"
+
+    async def resolve(self, session: aiohttp.ClientSession, url: str) -> dict | None:
+        headers = {
+            "User-Agent": USER_AGENT,
+            "Accept": "application/json, text/plain, */*",
+            "Accept-Language": "en-US,en;q=0.5",
+            "Content-Type": "application/json",
+            "Origin": "https://ytshorts.savetube.me",
+            "Alt-Used": "ytshorts.savetube.me",
+            "Sec-Fetch-Dest": "empty",
+            "Sec-Fetch-Mode": "cors",
+            "Sec-Fetch-Site": "same-origin",
+        }
+        async with session.post(
+            self.api,
+            headers=headers,
+            json={"url": url},
+            timeout=API_TIMEOUT,
+        ) as response:
+            response.raise_for_status()
+            response = await response.json(content_type=None)
+        responses = response.get("response", [])
+        if not responses:
+            return None
+        resolutions = responses[0].get("resolutions", [])
+        if not resolutions:
+            return None
+        return {
+            "link": resolutions.get("HD Video", ""),
+            "download": resolutions.get("Fast Download", ""),
+        }
+
+
+class TeraboxShareResolver(Resolver):
+    """
+    Talks to the terabox share/list API directly, authenticated with
+    `config.COOKIE`.
+    """
+
+    name = "terabox"
+    api = "https://www.terabox.com/share/list"
+
+    def __init__(self, cookie: str):
+        self.cookie = cookie
+
+    async def resolve(self, session: aiohttp.ClientSession, url: str) -> dict | None:
+        headers = {"User-Agent": USER_AGENT, "Cookie": self.cookie}
+        code = re.search(r"(?:/s/|surl=)(\w+)", url)
+        if not code:
+            return None
+        code = code.group(1)
+        async with session.get(url, headers=headers, timeout=PAGE_TIMEOUT) as response:
+            response.raise_for_status()
+            text = await response.text()
+        js_token = re.search(r"fn%28%22(\w+)%22%29", text)
+        log_id = re.search(r"dp-logid=(\w+)", text)
+        if not js_token:
+            return None
+        params = {
+            "app_id": "250528",
+            "web": "1",
+            "channel": "dubox",
+            "clienttype": "0",
+            "jsToken": js_token.group(1),
+            "dp-logid": log_id.group(1) if log_id else "",
+            "page": "1",
+            "num": "20",
+            "by": "name",
+            "order": "asc",
+            "shorturl": code[1:] if code.startswith("1") else code,
+            "root": "1",
+        }
+        async with session.get(
+            self.api, params=params, headers=headers, timeout=API_TIMEOUT
+        ) as response:
+            response.raise_for_status()
+            data = await response.json(content_type=None)
+        if data.get("errno"):
+            return None
+        files = data.get("list") or []
+        if not files or not files[0].get("dlink"):
+            return None
+        file = files[0]
+        dlink = file["dlink"]
+        async with session.head(dlink, headers=headers, timeout=HEAD_TIMEOUT) as response:
+            direct_link = response.headers.get("location")
+        return {
+            "link": dlink,
+            "download": dlink,
+            "direct_link": direct_link,
+            "file_name": file.get("server_filename"),
+            "sizebytes": int(file["size"]) if file.get("size") else None,
+            "thumb": (file.get("thumbs") or {}).get("url3"),
+        }
+
+
+class ResolverPool:
+    """
+    Picks resolver backends by their measured latency and error rate.
+
+    Backends whose circuit breaker is open are skipped. If the best backend
+    hasn't answered by its p90 latency, the next one is started as a hedge and
+    the first usable answer wins. A failed backend is replaced right away.
+    """
+
+    def __init__(
+        self,
+        resolvers: list[Resolver],
+        hedge_delay: float = DEFAULT_HEDGE_DELAY,
+        min_samples: int = MIN_HEDGE_SAMPLES,
+    ):
+        self.resolvers = resolvers
+        self.default_hedge_delay = hedge_delay
+        self.min_samples = min_samples
+        self.health = {resolver.name: Health(resolver.name) for resolver in resolvers}
+
+    def ranked(self) -> list[Resolver]:
+        return sorted(
+            self.resolvers,
+            key=lambda resolver: (
+                self.health[resolver.name].state != Health.CLOSED,
+                self.health[resolver.name].score,
+            ),
+        )
+
+    def hedge_delay(self, resolver: Resolver) -> float:
+        health = self.health[resolver.name]
+        if len(health.latencies) < self.min_samples:
+            return self.default_hedge_delay
+        return health.percentile(0.9)
+
+    async def _call(
+        self, resolver: Resolver, session: aiohttp.ClientSession, url: str
+    ) -> dict | None:
+        health = self.health[resolver.name]
+        start = time.perf_counter()
+        try:
+            result = await resolver.resolve(session, url)
+        except asyncio.CancelledError:
+            health.release()
+            raise
+        except Exception as e:
+            health.record(False, time.perf_counter() - start)
+            log.warning(f"Resolver {resolver.name} failed for {url}: {e}")
+            return None
+        # A well-formed "not found" is a healthy answer; a dead link must not
+        # open the breaker for the valid ones behind it.
+        health.record(True, time.perf_counter() - start)
+        return result
+
+    async def resolve(self, session: aiohttp.ClientSession, url: str) -> dict | None:
+        """
+        Resolves `url` through the healthiest backends, hedging slow ones.
+
+        Returns:
+            dict | None: The first usable answer, or None if every backend
+                failed or is unavailable.
+        """
+        candidates = iter(self.ranked())
+        tasks: set[asyncio.Task] = set()
+        delay = None
+
+        def launch() -> bool:
+            nonlocal delay
+            for resolver in candidates:
+                if not self.health[resolver.name].allow():
+                    continue
+                tasks.add(asyncio.create_task(self._call(resolver, session, url)))
+                delay = self.hedge_delay(resolver)
+                return True
+            delay = None
+            return False
+
+        if not launch():
+            log.error("All resolvers are unavailable")
+            return None
+        try:
+            while tasks:
+                done, _ = await asyncio.wait(
+                    tasks, timeout=delay, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    launch()
+                    continue
+                for task in done:
+                    tasks.discard(task)
+                    result = task.result()
+                    if result:
+                        return result
+                if not tasks:
+                    launch()
+        finally:
+            for task in tasks:
+                task.cancel()
+        return None
+
+    def stats(self) -> dict[str, dict]:
+        return {name: health.stats() for name, health in self.health.items()}
+
+
+def default_resolvers() -> list[Resolver]:
+    resolvers = [SavetubeResolver()]
+    if COOKIE:
+        resolvers.append(TeraboxShareResolver(COOKIE))
+    return resolvers
+
+
+pool = ResolverPool(default_resolvers())
@@ -1,11 +1,14 @@
 import asyncio
+import logging
 import os
 import time
+from io import BytesIO
 from pathlib import Path
 from uuid import uuid4
 
 import telethon
 from telethon import Button, TelegramClient, events, utils
+from telethon.errors import FilePart0MissingError, FilePartMissingError
 from telethon.events.newmessage import NewMessage
 from telethon.tl.functions.channels import GetMessagesRequest
 from telethon.tl.functions.messages import ForwardMessagesRequest
@@ -13,20 +16,39 @@ from telethon.tl.patched import Message
 from telethon.tl.types import Document
 from telethon.types import UpdateEditMessage
 
-from cansend import CanSend
-from config import BOT_USERNAME, PRIVATE_CHAT_ID
-from FastTelethon import upload_file
+import strategy
+from buffers import MemoryFull
+from buffers import pool as buffer_pool
+from config import BOT_USERNAME, PRIVATE_CHAT_ID, SMALL_FILE_SIZE
+from downloader import download_to_memory, is_partial, stream_parts
+from FastTelethon import (
+    get_part_size,
+    upload_buffer,
+    upload_file,
+    upload_part,
+    upload_stream,
+)
+from progress import scheduler as progress_scheduler
 from redis_db import db
+from thumbnails import get_thumbnail
 from tools import (
     convert_seconds,
     download_file,
-    download_image_to_bytesio,
     extract_code_from_url,
     get_formatted_size,
 )
+from workspace import WorkspaceFull, workspace
+
+log = logging.getLogger(__name__)
 
 
 class VideoSender:
+    # Pipe downloads straight into the upload when the size is known.
+    stream_upload = True
+    # Uploads of a downloaded file are retried from their checkpoint, and
+    # parts Telegram reports missing on send are uploaded again.
+    upload_attempts = 2
+    missing_part_retries = 3
 
     def __init__(
         self,
@@ -43,10 +65,14 @@ class VideoSender:
         self.message = message
         self.uuid = str(uuid4())
         self.stop_sending = False
-        self.thumbnail = self.get_thumbnail()
-        self.can_send = CanSend()
+        self.thumbnail = None
+        self.sent = False
+        self._send_lock = asyncio.Lock()
         self.start_time = time.time()
         self.task = None
+        self.path = workspace.path_for(
+            extract_code_from_url(url) or self.uuid, self.data["file_name"]
+        )
         self.client.add_event_handler(
             self.stop, events.CallbackQuery(pattern=f"^stop{self.uuid}")
         )
@@ -64,9 +90,6 @@ Size: **{self.data["size"]}**
             """
 
     async def progress_bar(self, current_downloaded, total_downloaded, state="Sending"):
-        if not self.can_send.can_send():
-            return
-
         bar_length = 20
         percent = current_downloaded / total_downloaded
         arrow = "█" * int(percent * bar_length)
@@ -87,34 +110,46 @@ Size: **{self.data["size"]}**
         time_line = f"Time Remaining: `{convert_seconds(time_remaining)}`"
         size_line = f"Size: **{get_formatted_size(current_downloaded)}** / **{get_formatted_size(total_downloaded)}**"
 
-        await self.edit_message.edit(
+        progress_scheduler.update(
+            self.uuid,
+            self.edit_message,
             f"{head_text}\n{progress_bar}\n{speed_line}\n{time_line}\n{size_line}",
-            parse_mode="markdown",
             buttons=[Button.inline("Stop", data=f"stop{self.uuid}")],
         )
 
     async def send_media(self, shorturl):
-        try:
-            self.thumbnail.seek(0) if self.thumbnail else None
-            spoiler_media = (
-                await self.client._file_to_media(
-                    self.data["direct_link"],
-                    supports_streaming=True,
-                    progress_callback=self.progress_bar,
-                    thumb=self.thumbnail,
-                )
-            )[1]
-            spoiler_media.spoiler = True
+        file = await strategy.execute(
+            self.data["direct_link"],
+            self.data["sizebytes"],
+            self.send_url,
+            self.send_local,
+        )
+        if not file:
+            return await self.handle_failed_download()
+        await self.save_forward_file(file, shorturl)
+
+    def _thumb(self):
+        """A copy of the thumbnail, so strategies running together don't share it."""
+        if not self.thumbnail:
+            return None
+        thumb = BytesIO(self.thumbnail.getvalue())
+        thumb.name = self.thumbnail.name
+        return thumb
+
+    async def _send(self, **kwargs):
+        """Sends the file to the chat once, even if two strategies finish together."""
+        async with self._send_lock:
+            if self.sent:
+                return None
             file = await self.client.send_file(
                 self.message.chat.id,
-                file=spoiler_media,
                 caption=self.caption,
+                background=True,
+                reply_to=self.message.id,
                 allow_cache=True,
                 force_document=False,
                 parse_mode="markdown",
-                reply_to=self.message.id,
                 supports_streaming=True,
-                background=True,
                 buttons=[
                     [
                         Button.url(
@@ -127,112 +162,187 @@ Size: **{self.data["size"]}**
                         Button.url("Group ", url="https://t.me/RoldexVerseChats"),
                     ],
                 ],
+                **kwargs,
             )
-            try:
-                if self.edit_message:
-                    await self.edit_message.delete()
-            except Exception as e:
-                pass
+            self.sent = True
+            return file
 
+    async def send_url(self):
+        """
+        Lets Telegram fetch the direct link itself. Returns None if it
+        couldn't.
+        """
+        try:
+            spoiler_media = (
+                await self.client._file_to_media(
+                    self.data["direct_link"],
+                    supports_streaming=True,
+                    progress_callback=self.progress_bar,
+                    thumb=self._thumb(),
+                )
+            )[1]
+            spoiler_media.spoiler = True
+            # Telegram only fetches the url when the media is sent.
+            file = await self._send(file=spoiler_media)
         except telethon.errors.rpcerrorlist.WebpageCurlFailedError:
-            path = Path(self.data["file_name"])
-            if not os.path.exists(path):
+            return None
+        if file:
+            await progress_scheduler.finish(self.uuid)
+        try:
+            if file and self.edit_message:
+                await self.edit_message.delete()
+        except Exception as e:
+            pass
+        return file
+
+    async def send_local(self):
+        """
+        Holds small files in memory between download and upload, pipes the
+        download into the upload when possible, and downloads the file into
+        the workspace first otherwise.
+        """
+        size = self.data["sizebytes"]
+        file = None
+        if size and int(size) <= SMALL_FILE_SIZE:
+            file = await self.send_in_memory()
+        # A hedged url upload may have sent the file meanwhile, and then every
+        # further attempt would download and upload it for nothing.
+        if self.sent:
+            return file
+        if not file and self.stream_upload:
+            file = await self.send_streamed()
+        if self.sent:
+            return file
+        if not file:
+            try:
+                async with workspace.reserve(self.path, self.data["sizebytes"]):
+                    file = await self.send_downloaded()
+            except WorkspaceFull as e:
+                log.warning(f"No disk space for {self.data['file_name']}: {e}")
+        return file
+
+    async def send_downloaded(self):
+        """
+        Downloads the file into the workspace (resuming a partial one if there
+        is one) and uploads it from there. Returns None if either step fails.
+        """
+        path = self.path
+        if not os.path.exists(path) or is_partial(path):
+            try:
+                await download_file(self.data["direct_link"], path, self.progress_bar)
+            except Exception:
+                progress_scheduler.update(
+                    self.uuid,
+                    self.edit_message,
+                    "Failed to Download the media. trying again.",
+                )
                 try:
-                    download_task = asyncio.create_task(
-                        download_file(
-                            self.data["direct_link"],
-                            self.data["file_name"],
-                            self.progress_bar,
-                        )
-                    )
-                    download = await asyncio.gather(download_task)
-                except:
-                    await self.edit_message.edit("Failed to Download the media. trying again.")
-                    try:
-                        download_task = asyncio.create_task(
-                                download_file(
-                                    self.data["link"],
-                                    self.data["file_name"],
-                                    self.progress_bar,
-                                )
-                            )
-                        download = await asyncio.gather(download_task)
-                    except:
-                        return await self.handle_failed_download()
-            else:
-                download = [path]
-            if not download or not download[0] or not os.path.exists(download[0]):
-                return await self.handle_failed_download()
-            self.download = Path(download[0])
+                    await download_file(self.data["link"], path, self.progress_bar)
+                except Exception:
+                    return None
+        if not os.path.exists(path):
+            return None
+        if self.data["sizebytes"] and os.path.getsize(path) != int(
+            self.data["sizebytes"]
+        ):
+            return None
+        self.download = Path(path)
+        attributes, mime_type = utils.get_attributes(self.download)
+        for attempt in range(self.upload_attempts):
             try:
                 with open(self.download, "rb") as out:
                     res = await upload_file(
-                        self.client, out, self.progress_bar, self.data["file_name"]
-                    )
-                    attributes, mime_type = utils.get_attributes(
-                        self.download,
-                    )
-                    file = await self.client.send_file(
-                        self.message.chat.id,
-                        file=res,
-                        caption=self.caption,
-                        background=True,
-                        reply_to=self.message.id,
-                        allow_cache=True,
-                        force_document=False,
-                        parse_mode="markdown",
-                        supports_streaming=True,
-                        thumb=self.thumbnail,
-                        # attributes=attributes,
-                        mime_type=mime_type,
-                        buttons=[
-                            [
-                                Button.url(
-                                    "Direct Link",
-                                    url=f"https://{BOT_USERNAME}.t.me?start={self.uuid}",
-                                ),
-                            ],
-                            [
-                                Button.url("Channel ", url="https://t.me/RoldexVerse"),
-                                Button.url(
-                                    "Group ", url="https://t.me/RoldexVerseChats"
-                                ),
-                            ],
-                        ],
+                        self.client,
+                        out,
+                        self.progress_bar,
+                        self.data["file_name"],
+                        checkpoint=True,
                     )
-                try:
-                    os.unlink(self.download)
-                except Exception:
-                    pass
-                try:
-                    os.unlink(self.data["file_name"])
-                except Exception:
-                    pass
+                    return await self.send_checked(out, res, mime_type)
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                self.client.remove_event_handler(
-                    self.stop, events.CallbackQuery(pattern=f"^stop{self.uuid}")
+                log.warning(
+                    f"Upload of {self.data['file_name']} failed"
+                    f" (attempt {attempt + 1}): {e!r}"
                 )
-                try:
-                    os.unlink(self.download)
-                except Exception:
-                    pass
-                try:
-                    os.unlink(self.data["file_name"])
-                except Exception:
-                    pass
-                return await self.handle_failed_download()
+        self.client.remove_event_handler(
+            self.stop, events.CallbackQuery(pattern=f"^stop{self.uuid}")
+        )
+        return None
 
-        await self.save_forward_file(file, shorturl)
+    async def send_checked(self, out, res, mime_type):
+        """Sends an uploaded file, uploading parts Telegram lost again."""
+        for _ in range(self.missing_part_retries):
+            try:
+                return await self.send_uploaded(res, mime_type)
+            except (FilePartMissingError, FilePart0MissingError) as e:
+                part = getattr(e, "which", 0)
+                log.warning(f"Part {part} of {self.data['file_name']} is missing")
+                await upload_part(self.client, out, res, part)
+        return await self.send_uploaded(res, mime_type)
 
-    async def handle_failed_download(self):
+    async def send_in_memory(self):
+        """
+        Downloads the file into a pooled memory buffer and uploads it from
+        there. Returns None if there is no memory for it right now or either
+        step fails.
+        """
         try:
-            os.unlink(self.data["file_name"])
-        except Exception:
-            pass
+            async with buffer_pool.lease(int(self.data["sizebytes"])) as buffer:
+                await download_to_memory(
+                    self.data["direct_link"], buffer, self.progress_bar
+                )
+                res = await upload_buffer(
+                    self.client, buffer, self.progress_bar, self.data["file_name"]
+                )
+                attributes, mime_type = utils.get_attributes(
+                    self.data["file_name"] or ""
+                )
+                return await self.send_checked(buffer, res, mime_type)
+        except MemoryFull as e:
+            log.info(f"Not holding {self.data['file_name']} in memory: {e}")
+            return None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning(f"In-memory send of {self.data['file_name']} failed: {e}")
+            return None
+
+    async def send_streamed(self):
+        """
+        Pipes the download straight into the upload, part by part, without
+        writing the file to disk. Needs the size from the resolver to lay out
+        the parts up front. Returns None if anything fails, so the caller can
+        fall back to downloading the file first.
+        """
+        file_size = self.data["sizebytes"]
+        if not file_size:
+            return None
         try:
-            os.unlink(self.download)
-        except Exception:
-            pass
+            parts = stream_parts(self.data["direct_link"], get_part_size(file_size))
+            res = await upload_stream(
+                self.client, parts, file_size, self.progress_bar, self.data["file_name"]
+            )
+            attributes, mime_type = utils.get_attributes(self.data["file_name"] or "")
+            return await self.send_uploaded(res, mime_type)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning(f"Streamed upload of {self.data['file_name']} failed: {e}")
+            return None
+
+    async def send_uploaded(self, res, mime_type):
+        return await self._send(
+            file=res,
+            thumb=self._thumb(),
+            # attributes=attributes,
+            mime_type=mime_type,
+        )
+
+    async def handle_failed_download(self):
+        await progress_scheduler.finish(self.uuid)
+        workspace.remove(self.path)
         try:
             await self.edit_message.edit(
                 f"Sorry! Download Failed but you can download it from [here]({self.data['direct_link']}) or [here]({self.data['link']}).",
@@ -258,28 +368,22 @@ Size: **{self.data["size"]}**
         self.client.remove_event_handler(
             self.stop, events.CallbackQuery(pattern=f"^stop{self.uuid}")
         )
+        await progress_scheduler.finish(self.uuid)
         try:
             await self.edit_message.delete()
         except Exception:
             pass
-        try:
-            os.unlink(self.data["file_name"])
-        except Exception:
-            pass
-        try:
-            os.unlink(self.download)
-        except Exception:
-            pass
+        workspace.touch(self.path)
         db.set(self.message.sender_id, time.monotonic(), ex=60)
         # await self.forward_file(
         #     self.client, forwarded_message[0].id, self.message, self.edit_message
         # )
 
     async def send_video(self):
-        self.thumbnail = download_image_to_bytesio(self.data["thumb"], "thumbnail.png")
         shorturl = extract_code_from_url(self.url)
         if not shorturl:
             return await self.edit_message.edit("Seems like your link is invalid.")
+        self.thumbnail = await self.get_thumbnail(shorturl)
 
         try:
             if self.edit_message:
@@ -298,21 +402,15 @@ Size: **{self.data["size"]}**
             self.stop, events.CallbackQuery(pattern=f"^stop{self.uuid}")
         )
         await event.answer("Process stopped.")
-        try:
-            os.unlink(self.data["file_name"])
-        except Exception:
-            pass
-        try:
-            os.unlink(self.download)
-        except Exception:
-            pass
+        workspace.remove(self.path)
+        await progress_scheduler.finish(self.uuid)
         try:
             await self.edit_message.delete()
         except Exception:
             pass
 
-    def get_thumbnail(self):
-        return download_image_to_bytesio(self.data["thumb"], "thumbnail.png")
+    async def get_thumbnail(self, shorturl):
+        return await get_thumbnail(shorturl, self.data["thumb"])
 
     @staticmethod
     async def forward_file(
@@ -0,0 +1,74 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Hashable
+
+log = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Makes sure only one coroutine works on a given key at a time.
+
+    The first caller of `do` runs the work, everyone arriving while it is in
+    flight can `wait` for it to finish and then reuse whatever it produced.
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def do(
+        self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args, **kwargs
+    ) -> Any:
+        """
+        Runs `fn(*args, **kwargs)` unless another call for `key` is running,
+        in which case its result is awaited and returned instead.
+
+        Args:
+            key (Hashable): The key the work is registered under.
+            fn (Callable[..., Awaitable[Any]]): The coroutine function to run.
+
+        Returns:
+            Any: The result of the call.
+        """
+        fut = self._calls.get(key)
+        if fut is not None:
+            return await asyncio.shield(fut)
+        fut = asyncio.get_running_loop().create_future()
+        self._calls[key] = fut
+        try:
+            result = await fn(*args, **kwargs)
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except BaseException as e:
+            fut.set_exception(e)
+            # Mark the exception as retrieved, the caller gets it below.
+            fut.exception()
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+
+    async def wait(self, key: Hashable) -> Any:
+        """
+        Waits for the call running under `key` to finish.
+
+        Returns:
+            Any: The result of the call, or None if nothing was in flight or
+                the call failed or got cancelled.
+        """
+        fut = self._calls.get(key)
+        if fut is None:
+            return None
+        await asyncio.wait([fut])
+        if fut.cancelled() or fut.exception() is not None:
+            return None
+        return fut.result()
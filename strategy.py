@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable
+from urllib.parse import urlparse
+
+from redis_db import db
+
+log = logging.getLogger(__name__)
+
+# Let Telegram fetch the direct link itself, or download and upload it here.
+URL_UPLOAD = "url"
+LOCAL = "local"
+HEDGED = "hedged"
+
+# Telegram's server side fetch almost never succeeds for files above this.
+URL_MAX_SIZE = 20 * 1024 * 1024
+# A host whose url uploads succeed this often gets them alone; one that
+# fails this often goes straight to the local pipeline. Anything in between
+# runs both, the local one started after the hedge delay.
+CONFIDENT_RATE = 0.8
+HEDGE_DELAY = 5.0
+MAX_HEDGE_DELAY = 30.0
+# Outcomes are halved once a host has more than this many, so old history
+# fades out, and dropped after a week without jobs.
+STATS_WINDOW = 100
+STATS_TTL = 7 * 24 * 60 * 60
+LATENCY_ALPHA = 0.3
+
+# Counts the outcome and folds the latency of a success into an EWMA.
+_RECORD_SCRIPT = db.register_script(
+    """
+redis.call('HINCRBY', KEYS[1], ARGV[1], 1)
+if ARGV[1] == 'ok' then
+    local sample = tonumber(ARGV[2])
+    local prev = tonumber(redis.call('HGET', KEYS[1], 'latency'))
+    if prev then
+        sample = prev + tonumber(ARGV[3]) * (sample - prev)
+    end
+    redis.call('HSET', KEYS[1], 'latency', tostring(sample))
+end
+local ok = tonumber(redis.call('HGET', KEYS[1], 'ok') or '0')
+local fail = tonumber(redis.call('HGET', KEYS[1], 'fail') or '0')
+if ok + fail > tonumber(ARGV[4]) then
+    redis.call('HSET', KEYS[1], 'ok', math.floor(ok / 2), 'fail', math.floor(fail / 2))
+end
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return 1
+"""
+)
+
+
+def host_of(url: str | None) -> str:
+    return (urlparse(url or "").hostname or "").lower()
+
+
+def _key(name: str, host: str) -> str:
+    return f"strategy:{name}:{host}"
+
+
+def stats(name: str, host: str) -> dict:
+    """
+    Returns the outcomes of a strategy on a host.
+
+    Returns:
+        dict: `ok` and `fail` counts and the EWMA `latency` of successes in
+            seconds, None if there was none yet.
+    """
+    data = db.hgetall(_key(name, host)) or {}
+    latency = data.get("latency")
+    return {
+        "ok": int(data.get("ok", 0)),
+        "fail": int(data.get("fail", 0)),
+        "latency": float(latency) if latency is not None else None,
+    }
+
+
+def success_rate(name: str, host: str) -> float:
+    """The smoothed success rate, 0.5 for a host that was never tried."""
+    s = stats(name, host)
+    return (s["ok"] + 1) / (s["ok"] + s["fail"] + 2)
+
+
+def record(name: str, host: str, ok: bool, latency: float) -> None:
+    try:
+        _RECORD_SCRIPT(
+            keys=[_key(name, host)],
+            args=[
+                "ok" if ok else "fail",
+                latency,
+                LATENCY_ALPHA,
+                STATS_WINDOW,
+                STATS_TTL,
+            ],
+        )
+    except Exception as e:
+        log.warning(f"Failed to record {name} outcome for {host}: {e}")
+
+
+def choose(host: str, size: int | None) -> str:
+    """
+    Picks how a file from `host` of `size` bytes should be sent.
+
+    Returns:
+        str: `URL_UPLOAD`, `LOCAL` or `HEDGED`.
+    """
+    if size and size > URL_MAX_SIZE:
+        return LOCAL
+    rate = success_rate(URL_UPLOAD, host)
+    if rate >= CONFIDENT_RATE:
+        return URL_UPLOAD
+    if rate <= 1 - CONFIDENT_RATE:
+        return LOCAL
+    return HEDGED
+
+
+def hedge_delay(host: str) -> float:
+    """How long a url upload on `host` runs alone before the local one joins."""
+    latency = stats(URL_UPLOAD, host)["latency"]
+    if latency is None:
+        return HEDGE_DELAY
+    return min(latency * 1.5, MAX_HEDGE_DELAY)
+
+
+async def _timed(name: str, host: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+    """Runs a strategy and records its outcome. Failures return None."""
+    start = time.monotonic()
+    try:
+        result = await fn()
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        log.warning(f"{name} strategy failed for {host}: {e!r}")
+        result = None
+    record(name, host, bool(result), time.monotonic() - start)
+    return result
+
+
+async def _hedge(
+    host: str,
+    url_upload: Callable[[], Awaitable[Any]],
+    local: Callable[[], Awaitable[Any]],
+) -> Any:
+    tasks = {asyncio.create_task(_timed(URL_UPLOAD, host, url_upload))}
+    try:
+        done, tasks = await asyncio.wait(tasks, timeout=hedge_delay(host))
+        for task in done:
+            if task.result():
+                return task.result()
+        tasks.add(asyncio.create_task(_timed(LOCAL, host, local)))
+        while tasks:
+            done, tasks = await asyncio.wait(
+                tasks, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.result():
+                    return task.result()
+        return None
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def execute(
+    url: str,
+    size: int | None,
+    url_upload: Callable[[], Awaitable[Any]],
+    local: Callable[[], Awaitable[Any]],
+) -> Any:
+    """
+    Sends a file with the strategy `choose` picks for it, falling back to the
+    local pipeline when a url upload fails. When both run, the first one to
+    succeed wins and the other is cancelled.
+
+    Parameters:
+        url (str): The direct link, whose host the stats are kept for.
+        size (int | None): The file size, if known.
+        url_upload: Sends the file by url. Returns the result or None.
+        local: Sends the file through the local pipeline.
+
+    Returns:
+        Any: The result of the winning strategy, or None if all failed.
+    """
+    host = host_of(url)
+    choice = choose(host, size)
+    log.info(f"Sending {url} with the {choice} strategy")
+    if choice == LOCAL:
+        return await _timed(LOCAL, host, local)
+    if choice == URL_UPLOAD:
+        return await _timed(URL_UPLOAD, host, url_upload) or await _timed(
+            LOCAL, host, local
+        )
+    return await _hedge(host, url_upload, local)
@@ -1,59 +1,27 @@
+import asyncio
+import logging
 import re
-from pprint import pp
+import time
 from urllib.parse import parse_qs, urlparse
 
-import requests
+import aiohttp
 
+from cache import TTLCache
+from http_client import HEAD_TIMEOUT, get_session
+from mirrors import pool as mirror_pool
+from resolvers import pool as resolver_pool
 from tools import get_formatted_size
+from urlmatch import check_url_patterns, get_urls_from_string  # noqa: F401
 
+log = logging.getLogger(__name__)
 
-def check_url_patterns(url):
-    patterns = [
-        r"ww\.mirrobox\.com",
-        r"www\.nephobox\.com",
-        r"freeterabox\.com",
-        r"www\.freeterabox\.com",
-        r"1024tera\.com",
-        r"4funbox\.co",
-        r"www\.4funbox\.com",
-        r"mirrobox\.com",
-        r"nephobox\.com",
-        r"terabox\.app",
-        r"terabox\.com",
-        r"www\.terabox\.ap",
-        r"www\.terabox\.com",
-        r"www\.1024tera\.co",
-        r"www\.momerybox\.com",
-        r"teraboxapp\.com",
-        r"momerybox\.com",
-        r"tibibox\.com",
-        r"www\.tibibox\.com",
-        r"www\.teraboxapp\.com",
-    ]
-
-    for pattern in patterns:
-        if re.search(pattern, url):
-            return True
-
-    return False
-
-
-def get_urls_from_string(string: str) -> list[str]:
-    """
-    Extracts URLs from a given string.
-
-    Args:
-        string (str): The input string from which to extract URLs.
+# Resolved links are reused until shortly before the direct link expires.
+RESOLVE_TTL = 60 * 60
+LINK_EXPIRY_MARGIN = 5 * 60
+# Broken links, dead upstreams and timeouts are remembered for a short while.
+DEAD_LINK_TTL = 60
 
-    Returns:
-        list[str]: A list of URLs extracted from the input string. If no URLs are found, an empty list is returned.
-    """
-    pattern = r"(https?://\S+)"
-    urls = re.findall(pattern, string)
-    urls = [url for url in urls if check_url_patterns(url)]
-    if not urls:
-        return []
-    return urls[0]
+resolution_cache = TTLCache(maxsize=4096)
 
 
 def find_between(data: str, first: str, last: str) -> str | None:
@@ -98,70 +66,177 @@ def extract_surl_from_url(url: str) -> str | None:
         return False
 
 
-def get_data(url: str):
-    netloc = urlparse(url).netloc
-    url = url.replace(netloc, "1024terabox.com")
-    response = requests.get(
-        url,
-        data="",
-    )
-    if not response.status_code == 200:
-        return False
-    default_thumbnail = find_between(response.text, 'og:image" content="', '"')
-
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:126.0) Gecko/20100101 Firefox/126.0",
-        "Accept": "application/json, text/plain, */*",
-        "Accept-Language": "en-US,en;q=0.5",
-        "Content-Type": "application/json",
-        "Origin": "https://ytshorts.savetube.me",
-        "Alt-Used": "ytshorts.savetube.me",
-        "Sec-Fetch-Dest": "empty",
-        "Sec-Fetch-Mode": "cors",
-        "Sec-Fetch-Site": "same-origin",
-    }
+async def _timed(name: str, timings: dict, coro):
+    start = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        timings[name] = round(time.perf_counter() - start, 4)
 
-    response = requests.post(
-        "https://ytshorts.savetube.me/api/v1/terabox-downloader",
-        headers=headers,
-        json={"url": url},
-    )
-    if response.status_code != 200:
-        return False
-    response = response.json()
-    responses = response.get("response", [])
-    if not responses:
-        return False
-    resolutions = responses[0].get("resolutions", [])
-    if not resolutions:
+
+async def fetch_thumbnail(session: aiohttp.ClientSession, url: str) -> str | bool | None:
+    """
+    Fetches the share page from the healthiest mirror and extracts its
+    og:image thumbnail.
+
+    Returns:
+        str | bool | None: The thumbnail url, None if the page has none, or
+            False if no mirror could serve the share page.
+    """
+    text = await mirror_pool.fetch(session, url)
+    if text is None:
         return False
-    download = resolutions.get("Fast Download", "")
-    video = resolutions.get("HD Video", "")
+    return find_between(text, 'og:image" content="', '"')
+
+
+async def _known(value):
+    return value
 
-    response = requests.request(
-        "HEAD",
-        video,
-        data="",
+
+async def probe_video(
+    session: aiohttp.ClientSession, video: str
+) -> tuple[int | None, str | None]:
+    """
+    Sends a HEAD request to the video url for its size and file name.
+
+    Returns:
+        tuple[int | None, str | None]: The content length and the file name.
+    """
+    async with session.head(video, timeout=HEAD_TIMEOUT) as response:
+        content_length = response.headers.get("Content-Length", 0)
+        idk = response.headers.get("content-disposition")
+    fname = re.findall('filename="(.+)"', idk) if idk else None
+    return (
+        int(content_length) if content_length else None,
+        fname[0] if fname else None,
     )
-    content_length = response.headers.get("Content-Length", 0)
-    if not content_length:
-        content_length = None
-    idk = response.headers.get("content-disposition")
-    if idk:
-        fname = re.findall('filename="(.+)"', idk)
-    else:
-        fname = None
-    response = requests.head(
-        download,
+
+
+async def probe_download(session: aiohttp.ClientSession, download: str) -> str | None:
+    async with session.head(download, timeout=HEAD_TIMEOUT) as response:
+        return response.headers.get("location")
+
+
+async def get_data(url: str) -> dict | bool:
+    """
+    Resolves a terabox share url into downloadable links.
+
+    The share page fetch starts alongside the resolver backends (see
+    `resolvers.ResolverPool`), and both HEAD probes run concurrently once a
+    backend answers, so a resolve costs the slowest hop instead of their
+    sum. The time spent in every branch is returned under
+    the "timings" key.
+
+    Args:
+        url (str): The terabox share url.
+
+    Returns:
+        dict | bool: The file metadata, or False if the link could not be resolved.
+    """
+    session = await get_session()
+    netloc = urlparse(url).netloc
+    url = url.replace(netloc, "1024terabox.com")
+    timings = {}
+    started = time.perf_counter()
+
+    page = asyncio.create_task(
+        _timed("page", timings, fetch_thumbnail(session, url))
     )
+    try:
+        resolution = await _timed("api", timings, resolver_pool.resolve(session, url))
+        if not resolution:
+            return False
+        download = resolution.get("download", "")
+        video = resolution.get("link", "")
+
+        if resolution.get("sizebytes") and resolution.get("file_name"):
+            video_probe = _known((resolution["sizebytes"], resolution["file_name"]))
+        else:
+            video_probe = probe_video(session, video)
+        if resolution.get("direct_link"):
+            download_probe = _known(resolution["direct_link"])
+        else:
+            download_probe = probe_download(session, download)
+        default_thumbnail, (content_length, fname), direct_link = await asyncio.gather(
+            page,
+            _timed("head_video", timings, video_probe),
+            _timed("head_download", timings, download_probe),
+        )
+    finally:
+        page.cancel()
+    if default_thumbnail is False:
+        return False
+    default_thumbnail = default_thumbnail or resolution.get("thumb")
+    timings["total"] = round(time.perf_counter() - started, 4)
+    log.debug(f"Resolved {url} in {timings}")
 
-    direct_link = response.headers.get("location")
     data = {
-        "file_name": (fname[0] if fname else None),
+        "file_name": fname,
         "link": (video if video else None),
-        "direct_link": (direct_link if direct_link else download if list else None),
+        "direct_link": (direct_link if direct_link else download if download else None),
         "thumb": (default_thumbnail if default_thumbnail else None),
-        "size": (get_formatted_size(int(content_length)) if content_length else None),
-        "sizebytes": (int(content_length) if content_length else None),
+        "size": (get_formatted_size(content_length) if content_length else None),
+        "sizebytes": content_length,
+        "timings": timings,
     }
     return data
+
+
+def link_ttl(link: str | None) -> float:
+    """
+    Returns how long a resolved direct link can be cached.
+
+    Terabox download links carry an `expires` query parameter such as `8h`.
+    When it is present the link is cached until `LINK_EXPIRY_MARGIN` seconds
+    before it runs out, otherwise `RESOLVE_TTL` is used.
+
+    Args:
+        link (str | None): The direct download link.
+
+    Returns:
+        float: The number of seconds the link can be cached.
+    """
+    if not link:
+        return RESOLVE_TTL
+    expires = parse_qs(urlparse(link).query).get("expires", [None])[0]
+    if not expires:
+        return RESOLVE_TTL
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    try:
+        if expires[-1].lower() in units:
+            seconds = float(expires[:-1]) * units[expires[-1].lower()]
+        else:
+            seconds = float(expires)
+    except ValueError:
+        return RESOLVE_TTL
+    return max(seconds - LINK_EXPIRY_MARGIN, 0)
+
+
+async def get_data_cached(url: str, code: str) -> dict | bool:
+    """
+    Same as `get_data`, but answers from `resolution_cache` when possible.
+
+    Successful resolutions are cached per share code for as long as the direct
+    link stays valid. Failures are cached for `DEAD_LINK_TTL` seconds so
+    repeated requests for a broken link don't reach the upstream again.
+
+    Args:
+        url (str): The terabox share url.
+        code (str): The share code, as returned by `extract_code_from_url`.
+
+    Returns:
+        dict | bool: The file metadata, or False if the link could not be resolved.
+    """
+    cached = resolution_cache.get(code)
+    if cached is not None:
+        return dict(cached) if cached else False
+    try:
+        data = await get_data(url)
+    except Exception as e:
+        log.warning(f"Failed to resolve {url}: {e}")
+        data = False
+    if not data:
+        resolution_cache.set(code, False, DEAD_LINK_TTL)
+        return False
+    resolution_cache.set(code, data, link_ttl(data["direct_link"]))
+    return dict(data)
@@ -0,0 +1,77 @@
+import asyncio
+import logging
+from io import BytesIO
+
+from PIL import Image
+
+from cache import LRUCache
+from http_client import PAGE_TIMEOUT, get_session
+from singleflight import SingleFlight
+
+log = logging.getLogger(__name__)
+
+# Telegram wants video thumbnails as JPEGs no bigger than 320px per side.
+THUMB_SIZE = 320
+THUMB_QUALITY = 85
+CACHE_BYTES = 32 * 1024 * 1024
+
+cache = LRUCache(CACHE_BYTES)
+_fetches = SingleFlight()
+
+
+def make_thumbnail(data: bytes) -> bytes:
+    """
+    Converts any image Pillow can read into a JPEG that fits in
+    `THUMB_SIZE`x`THUMB_SIZE`.
+
+    Parameters:
+        data (bytes): The source image.
+
+    Returns:
+        bytes: The JPEG thumbnail.
+    """
+    with Image.open(BytesIO(data)) as image:
+        image = image.convert("RGB")
+        image.thumbnail((THUMB_SIZE, THUMB_SIZE))
+        out = BytesIO()
+        image.save(out, "JPEG", quality=THUMB_QUALITY, optimize=True)
+    return out.getvalue()
+
+
+async def _fetch(url: str) -> bytes | None:
+    session = await get_session()
+    async with session.get(url, timeout=PAGE_TIMEOUT) as response:
+        if response.status != 200:
+            return None
+        data = await response.read()
+    return await asyncio.to_thread(make_thumbnail, data)
+
+
+async def get_thumbnail(code: str, url: str | None) -> BytesIO | None:
+    """
+    Returns the thumbnail of a share code, fetching and converting it once and
+    serving it from an LRU cache afterwards.
+
+    Parameters:
+        code (str): The share code the thumbnail belongs to.
+        url (str | None): The og:image url of the share.
+
+    Returns:
+        BytesIO | None: A fresh buffer with the JPEG thumbnail, or None if
+            there is none or it could not be fetched.
+    """
+    data = cache.get(code)
+    if data is None:
+        if not url:
+            return None
+        try:
+            data = await _fetches.do(code, _fetch, url)
+        except Exception as e:
+            log.warning(f"Failed to fetch thumbnail {url}: {e}")
+            return None
+        if not data:
+            return None
+        cache.set(code, data)
+    thumbnail = BytesIO(data)
+    thumbnail.name = "thumbnail.jpg"
+    return thumbnail
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import uuid
+
+from config import BOT_USERNAME, PUBLIC_EARN_API
+from http_client import API_TIMEOUT, get_session
+from redis_db import db
+
+log = logging.getLogger(__name__)
+
+SHORTENER_API = "https://publicearn.com/api"
+POOL_KEY = "token_pool"
+# Number of unclaimed token urls kept ready.
+POOL_SIZE = 20
+# Seconds between two pool checks, and between two calls to the shortener.
+REFILL_INTERVAL = 30
+SHORTEN_DELAY = 1.5
+# How long a claimed token stays valid.
+TOKEN_TTL = 21600
+
+# Pops an unbound "uid|url" entry and binds it to the sender in one round trip.
+_CLAIM_SCRIPT = db.register_script(
+    """
+local entry = redis.call('LPOP', KEYS[1])
+if not entry then
+    return false
+end
+local sep = string.find(entry, '|', 1, true)
+local uid = string.sub(entry, 1, sep - 1)
+local url = string.sub(entry, sep + 1)
+redis.call('SET', 'token_' .. uid, ARGV[1] .. '|' .. url, 'EX', ARGV[2])
+return url
+"""
+)
+
+
+async def shorten(uid: str) -> str | None:
+    """
+    Creates the ad link for a token through the shortener API.
+
+    Parameters:
+        uid (str): The token uuid.
+
+    Returns:
+        str | None: The shortened url, or None if the shortener failed.
+    """
+    session = await get_session()
+    params = {
+        "api": PUBLIC_EARN_API,
+        "url": f"https://t.me/{BOT_USERNAME}?start=token_{uid}",
+        "alias": uid.split("-", maxsplit=2)[0],
+    }
+    try:
+        async with session.get(SHORTENER_API, params=params, timeout=API_TIMEOUT) as r:
+            r.raise_for_status()
+            data = await r.json(content_type=None)
+    except Exception as e:
+        log.warning(f"Shortener request failed: {e}")
+        return None
+    if data.get("status") == "success":
+        return data.get("shortenedUrl")
+    return None
+
+
+async def claim_token(sender_id: int) -> str | None:
+    """
+    Binds a pre-generated token url to `sender_id` and returns it. Falls back
+    to shortening a new one when the pool is empty.
+
+    Parameters:
+        sender_id (int): The user the token is for.
+
+    Returns:
+        str | None: The url the user has to open, or None on failure.
+    """
+    url = _CLAIM_SCRIPT(keys=[POOL_KEY], args=[sender_id, TOKEN_TTL])
+    if url:
+        return url
+    uid = str(uuid.uuid4())
+    url = await shorten(uid)
+    if url:
+        db.set(f"token_{uid}", f"{sender_id}|{url}", ex=TOKEN_TTL)
+    return url
+
+
+async def refill() -> int:
+    """
+    Tops the pool up to `POOL_SIZE` entries.
+
+    Returns:
+        int: The number of entries added.
+    """
+    added = 0
+    while db.llen(POOL_KEY) < POOL_SIZE:
+        uid = str(uuid.uuid4())
+        url = await shorten(uid)
+        if not url:
+            break
+        db.rpush(POOL_KEY, f"{uid}|{url}")
+        added += 1
+        await asyncio.sleep(SHORTEN_DELAY)
+    return added
+
+
+async def run_refiller() -> None:
+    """Keeps the pool filled for as long as the bot runs."""
+    while True:
+        try:
+            added = await refill()
+            if added:
+                log.info(f"Added {added} tokens to the pool")
+        except Exception as e:
+            log.exception(f"Failed to refill the token pool: {e}")
+        await asyncio.sleep(REFILL_INTERVAL)
+
+
+if __name__ == "__main__":
+    from aiohttp import web
+
+    from http_client import close_session
+
+    # Runs refill and claim_token end to end against a local stand-in for the
+    # shortener, on throwaway keys in the configured redis.
+    POOL_KEY = "token_pool_selftest"
+    POOL_SIZE = 5
+    SHORTEN_DELAY = 0
+    SHORTENER_API = "http://127.0.0.1:8920/api"
+    failing = False
+    requests_seen = 0
+
+    async def serve(request):
+        global requests_seen
+        requests_seen += 1
+        if failing:
+            return web.json_response({"status": "error", "message": "quota"})
+        uid = request.query["url"].rsplit("token_", 1)[1]
+        assert request.query["alias"] == uid.split("-", maxsplit=2)[0]
+        return web.json_response(
+            {"status": "success", "shortenedUrl": f"https://short.test/{uid}"}
+        )
+
+    def uid_of(url: str) -> str:
+        return url.rsplit("/", 1)[1]
+
+    async def selftest():
+        global failing
+        app = web.Application()
+        app.router.add_get("/api", serve)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 8920).start()
+        uids = []
+        db.delete(POOL_KEY)
+        try:
+            assert await refill() == POOL_SIZE
+            assert await refill() == 0
+            assert requests_seen == POOL_SIZE
+            pooled = db.lrange(POOL_KEY, 0, -1)
+
+            url = await claim_token(42)
+            uids.append(uid_of(url))
+            assert f"{uids[0]}|{url}" == pooled[0]
+            assert db.get(f"token_{uids[0]}") == f"42|{url}"
+            assert db.ttl(f"token_{uids[0]}") > 0
+            assert db.llen(POOL_KEY) == POOL_SIZE - 1
+
+            # An empty pool falls back to shortening on the spot.
+            uids += [entry.split("|", 1)[0] for entry in pooled[1:]]
+            db.delete(POOL_KEY)
+            url = await claim_token(43)
+            uids.append(uid_of(url))
+            assert db.get(f"token_{uids[-1]}") == f"43|{url}"
+
+            failing = True
+            assert await refill() == 0
+            assert await claim_token(44) is None
+            print(f"token pool ok, {requests_seen} shortener calls")
+        finally:
+            db.delete(POOL_KEY, *(f"token_{uid}" for uid in uids))
+            await runner.cleanup()
+            await close_session()
+
+    asyncio.run(selftest())
@@ -0,0 +1,181 @@
+import re
+
+# Registrable domains of terabox and its mirrors. Any subdomain of these
+# (www., dm., ...) is accepted as well.
+SUPPORTED_DOMAINS = frozenset(
+    {
+        "terabox.com",
+        "terabox.app",
+        "teraboxapp.com",
+        "1024tera.com",
+        "1024terabox.com",
+        "freeterabox.com",
+        "4funbox.com",
+        "4funbox.co",
+        "mirrobox.com",
+        "nephobox.com",
+        "momerybox.com",
+        "tibibox.com",
+    }
+)
+
+_URL_RE = re.compile(r"https?://([^/\s?#:@]+)(?::\d+)?\S*", re.IGNORECASE)
+_CODE_RE = re.compile(r"/s/(\w+)|[?&]surl=(\w+)")
+
+
+def is_supported_host(host: str) -> bool:
+    """
+    Check if a host name is one of the supported domains or a subdomain of one.
+
+    Parameters:
+        host (str): The host name, without scheme or port.
+
+    Returns:
+        bool: True if the host is supported, False otherwise.
+    """
+    host = host.lower().rstrip(".")
+    while True:
+        if host in SUPPORTED_DOMAINS:
+            return True
+        dot = host.find(".")
+        if dot < 0:
+            return False
+        host = host[dot + 1 :]
+
+
+def match_url(url: str) -> tuple[str, str | None] | None:
+    """
+    Matches a single URL against the supported domains.
+
+    Parameters:
+        url (str): The URL to match.
+
+    Returns:
+        tuple[str, str | None] | None: The URL and its share code (None if it
+            has none), or None if the URL is not a supported one.
+    """
+    match = _URL_RE.match(url)
+    if not match or not is_supported_host(match.group(1)):
+        return None
+    return match.group(0), _code_from(match.group(0))
+
+
+def find_share_link(text: str) -> tuple[str, str | None] | None:
+    """
+    Finds the first supported URL in a piece of text and its share code in
+    one pass.
+
+    Parameters:
+        text (str): The text to search, e.g. a chat message.
+
+    Returns:
+        tuple[str, str | None] | None: The first supported URL and its share
+            code (None if it has none), or None if no supported URL was found.
+    """
+    if "://" not in text:
+        return None
+    for match in _URL_RE.finditer(text):
+        if is_supported_host(match.group(1)):
+            return match.group(0), _code_from(match.group(0))
+    return None
+
+
+def _code_from(url: str) -> str | None:
+    match = _CODE_RE.search(url)
+    if not match:
+        return None
+    return match.group(1) or match.group(2)
+
+
+def check_url_patterns(url: str) -> bool:
+    """
+    Check if the given URL points to terabox or one of its mirrors.
+
+    Parameters:
+        url (str): The URL to be checked.
+
+    Returns:
+        bool: True if the URL is supported, False otherwise.
+    """
+    return match_url(url) is not None
+
+
+def extract_code_from_url(url: str) -> str | None:
+    """
+    Extracts the share code (`/s/<code>` or `surl=<code>`) from a URL.
+
+    Parameters:
+        url (str): The URL to extract the code from.
+
+    Returns:
+        str: The extracted code, or None if the URL does not contain a code.
+    """
+    return _code_from(url)
+
+
+def get_urls_from_string(string: str) -> str | None:
+    """
+    Extracts the first supported URL from a given string.
+
+    Parameters:
+        string (str): The input string.
+
+    Returns:
+        str: The first supported URL found in the input string, or None if
+            no URLs were found.
+    """
+    found = find_share_link(string)
+    return found[0] if found else None
+
+
+if __name__ == "__main__":
+    import timeit
+
+    legacy_patterns = [
+        r"ww\.mirrobox\.com",
+        r"www\.nephobox\.com",
+        r"freeterabox\.com",
+        r"www\.freeterabox\.com",
+        r"1024tera\.com",
+        r"4funbox\.co",
+        r"www\.4funbox\.com",
+        r"mirrobox\.com",
+        r"nephobox\.com",
+        r"terabox\.app",
+        r"terabox\.com",
+        r"www\.terabox\.ap",
+        r"www\.terabox\.com",
+        r"www\.1024tera\.co",
+        r"www\.momerybox\.com",
+        r"teraboxapp\.com",
+        r"momerybox\.com",
+        r"tibibox\.com",
+        r"www\.tibibox\.com",
+        r"www\.teraboxapp\.com",
+    ]
+
+    def legacy(string: str):
+        urls = re.findall(r"(https?://\S+)", string)
+        urls = [u for u in urls if any(re.search(p, u) for p in legacy_patterns)]
+        if not urls:
+            return None
+        code = re.search(r"/s/(\w+)", urls[0]) or re.search(r"surl=(\w+)", urls[0])
+        return urls[0], code.group(1) if code else None
+
+    messages = {
+        "plain chat": "hey, did you watch the match yesterday? it was insane lol",
+        "other link": "check this out https://www.youtube.com/watch?v=dQw4w9WgXcQ it's great",
+        "share link": "bro here https://teraboxapp.com/s/1AbCdEfGhIjKlMnOp plz download",
+        "surl link": "https://www.1024tera.com/sharing/link?surl=AbCdEfGhIjKlMnOp",
+        "many links": " ".join(
+            f"https://example{i}.org/path/{i}?q=terabox" for i in range(10)
+        )
+        + " https://www.terabox.app/s/1XyZ",
+    }
+    number = 20000
+    print(f"{'message':<12} {'legacy':>10} {'urlmatch':>10}  (us per message)")
+    for name, text in messages.items():
+        assert legacy(text) == find_share_link(text), name
+        old = timeit.timeit(lambda: legacy(text), number=number) / number * 1e6
+        new = timeit.timeit(lambda: find_share_link(text), number=number) / number * 1e6
+        print(f"{name:<12} {old:>10.2f} {new:>10.2f}")
@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import os
+import re
+import shutil
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+from config import DISK_QUOTA, DOWNLOAD_DIR
+from downloader import JOURNAL_SUFFIX, remove_partial
+from FastTelethon import CHECKPOINT_SUFFIX
+
+log = logging.getLogger(__name__)
+
+# Space left alone on the disk no matter what the quota says.
+MIN_FREE_SPACE = 512 * 1024 * 1024
+# Reserved for downloads whose size the resolver couldn't tell.
+UNKNOWN_SIZE = 500 * 1024 * 1024
+# How long a job waits for space before giving up.
+QUEUE_TIMEOUT = 30 * 60
+# Marks a file a job is using, with the pid of the process running the job,
+# so /removeall in another process leaves it alone.
+LOCK_SUFFIX = ".lock"
+# Files kept next to a download that belong to it.
+SIDECAR_SUFFIXES = (JOURNAL_SUFFIX, CHECKPOINT_SUFFIX, LOCK_SUFFIX)
+
+
+class WorkspaceFull(Exception):
+    pass
+
+
+class Workspace:
+    """
+    The spool directory downloads are written to.
+
+    Every job reserves the size of its file before downloading, and waits in
+    line while the quota (or the free disk space) can't fit it. Finished files
+    stay around for reuse and are evicted least recently used first when a new
+    job needs the space.
+    """
+
+    def __init__(self, root: str, quota: int):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.quota = quota
+        self.active: dict[str, int] = {}
+        self.idle: OrderedDict[str, None] = OrderedDict()
+        self._cond = asyncio.Condition()
+        entries = [p for p in self.root.iterdir() if p.is_file()]
+        for entry in sorted(entries, key=lambda p: p.stat().st_mtime):
+            if not entry.name.endswith(SIDECAR_SUFFIXES):
+                self.idle[str(entry)] = None
+
+    def path_for(self, code: str, file_name: str | None) -> str:
+        """
+        Returns the path a job's file is downloaded to. The share code prefix
+        keeps jobs apart, while keeping the path stable so a restarted job can
+        resume its partial file.
+        """
+        name = os.path.basename(file_name or "") or "video.mp4"
+        name = re.sub(r"[^\w.\- ]", "_", name)[:150]
+        return str(self.root / f"{code}_{name}")
+
+    @staticmethod
+    def _size_on_disk(path: str) -> int:
+        size = 0
+        for p in (path, *(f"{path}{suffix}" for suffix in SIDECAR_SUFFIXES)):
+            try:
+                size += os.path.getsize(p)
+            except OSError:
+                pass
+        return size
+
+    @staticmethod
+    def _allocated(path: str) -> int:
+        """
+        The disk space `path` and its sidecars actually take. Segmented
+        downloads preallocate sparse files, whose apparent size says nothing
+        about the blocks still to be written.
+        """
+        size = 0
+        for p in (path, *(f"{path}{suffix}" for suffix in SIDECAR_SUFFIXES)):
+            try:
+                size += os.stat(p).st_blocks * 512
+            except OSError:
+                pass
+        return size
+
+    def used(self) -> int:
+        return sum(self.active.values()) + sum(
+            self._size_on_disk(path) for path in self.idle
+        )
+
+    def available(self) -> int:
+        pending = sum(
+            max(size - self._allocated(path), 0)
+            for path, size in self.active.items()
+        )
+        free = shutil.disk_usage(self.root).free - MIN_FREE_SPACE - pending
+        return min(self.quota - self.used(), free)
+
+    def _make_room(self, needed: int, keep: str) -> bool:
+        """Evicts idle files, oldest first, until `needed` bytes fit."""
+        for path in list(self.idle):
+            if self.available() >= needed:
+                break
+            if path == keep:
+                continue
+            log.info(f"Evicting {path} to free space")
+            self.remove(path)
+        return self.available() >= needed
+
+    @asynccontextmanager
+    async def reserve(self, path: str, size: int | None):
+        """
+        Reserves `size` bytes for the file at `path` for the duration of the
+        block, waiting while there's no room for it.
+
+        Raises:
+            WorkspaceFull: If the file can never fit or no room was made
+                within `QUEUE_TIMEOUT` seconds.
+        """
+        size = size or UNKNOWN_SIZE
+        if size > self.quota:
+            raise WorkspaceFull(f"{size} bytes exceed the quota of {self.quota}")
+        async with self._cond:
+            # A leftover partial or finished file of this job already counts.
+            self.idle.pop(path, None)
+            needed = max(size - self._size_on_disk(path), 0)
+            try:
+                await asyncio.wait_for(
+                    self._cond.wait_for(lambda: self._make_room(needed, path)),
+                    QUEUE_TIMEOUT,
+                )
+            except asyncio.TimeoutError:
+                raise WorkspaceFull(f"No room for {size} bytes")
+            self.active[path] = size
+            self._lock(path)
+        try:
+            yield path
+        finally:
+            async with self._cond:
+                self.active.pop(path, None)
+                self._unlock(path)
+                if os.path.exists(path):
+                    self.idle[path] = None
+                self._cond.notify_all()
+
+    @staticmethod
+    def _lock(path: str) -> None:
+        with open(f"{path}{LOCK_SUFFIX}", "w") as f:
+            f.write(str(os.getpid()))
+
+    @staticmethod
+    def _unlock(path: str) -> None:
+        try:
+            os.unlink(f"{path}{LOCK_SUFFIX}")
+        except FileNotFoundError:
+            pass
+
+    def in_use(self, path: str) -> bool:
+        """
+        Returns whether a job in this or another process has reserved `path`.
+        Locks left behind by a process that is gone don't count.
+        """
+        if path in self.active:
+            return True
+        try:
+            with open(f"{path}{LOCK_SUFFIX}") as f:
+                pid = int(f.read())
+        except (OSError, ValueError):
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def touch(self, path: str) -> None:
+        if path in self.idle:
+            self.idle.move_to_end(path)
+
+    def remove(self, path: str | None) -> None:
+        if not path:
+            return
+        self.idle.pop(path, None)
+        try:
+            remove_partial(path)
+            if os.path.exists(f"{path}{CHECKPOINT_SUFFIX}"):
+                os.unlink(f"{path}{CHECKPOINT_SUFFIX}")
+            self._unlock(path)
+        except OSError as e:
+            log.warning(f"Failed to remove {path}: {e}")
+
+    def clear(self) -> None:
+        """
+        Removes every file in the spool directory that no job is using, in
+        this process or another one.
+        """
+        for entry in list(self.root.iterdir()):
+            base = str(entry)
+            for suffix in SIDECAR_SUFFIXES:
+                base = base.removesuffix(suffix)
+            if entry.is_file() and not self.in_use(base):
+                self.remove(base)
+
+
+workspace = Workspace(DOWNLOAD_DIR, DISK_QUOTA)